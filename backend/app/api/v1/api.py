@@ -3,7 +3,7 @@ API路由定义
 """
 from fastapi import APIRouter
 
-from app.api.v1.endpoints import documents, chat, health
+from app.api.v1.endpoints import documents, chat, health, admin
 
 api_router = APIRouter()
 
@@ -11,3 +11,4 @@ api_router = APIRouter()
 api_router.include_router(health.router, tags=["health"])
 api_router.include_router(documents.router, prefix="/documents", tags=["documents"])
 api_router.include_router(chat.router, prefix="/chat", tags=["chat"])
+api_router.include_router(admin.router, prefix="/admin", tags=["admin"])
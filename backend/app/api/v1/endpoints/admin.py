@@ -0,0 +1,67 @@
+"""
+向量库运维端点
+"""
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from loguru import logger
+
+from app.core.config import Settings, settings
+from app.services.vector_store_manager import vector_store_manager
+
+def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """
+    运维端点可以覆盖整个知识库，需要在 X-Admin-Token 请求头中携带 SECRET_KEY
+    """
+    if settings.SECRET_KEY == Settings.model_fields["SECRET_KEY"].default:
+        raise HTTPException(status_code=403, detail="请先配置 SECRET_KEY 以启用运维端点")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.SECRET_KEY):
+        raise HTTPException(status_code=401, detail="无效的管理令牌")
+
+router = APIRouter(dependencies=[Depends(verify_admin_token)])
+
+class SnapshotRequest(BaseModel):
+    """快照请求"""
+    name: str
+
+@router.get("/vector-store/snapshots")
+async def list_snapshots():
+    """
+    列出快照
+    """
+    return {"snapshots": vector_store_manager.list_snapshots()}
+
+@router.post("/vector-store/snapshot")
+async def export_snapshot(request: SnapshotRequest):
+    """
+    导出向量库快照
+    """
+    logger.info(f"Snapshot export requested: {request.name}")
+    path = vector_store_manager.snapshot_path(request.name)
+    return await run_in_threadpool(vector_store_manager.export_snapshot, path)
+
+@router.post("/vector-store/restore")
+async def restore_snapshot(request: SnapshotRequest):
+    """
+    从快照恢复向量库
+    """
+    logger.info(f"Snapshot restore requested: {request.name}")
+    path = vector_store_manager.snapshot_path(request.name)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail=f"快照不存在: {path.name}")
+    
+    try:
+        return await run_in_threadpool(vector_store_manager.restore_snapshot, path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/vector-store/compact")
+async def compact_vector_store():
+    """
+    在线压缩向量库
+    """
+    logger.info("Vector store compaction requested")
+    return await run_in_threadpool(vector_store_manager.compact)
@@ -4,6 +4,10 @@
 from fastapi import APIRouter
 from loguru import logger
 
+from app.services.llm_scheduler import llm_scheduler
+from app.services.index_publisher import index_publisher
+from app.services.query_precompute import query_precomputer
+
 router = APIRouter()
 
 @router.get("/health")
@@ -28,6 +32,8 @@ async def readiness_check():
         "status": "ready",
         "dependencies": {
             "vector_db": "not_implemented",
-            "ollama": "not_implemented"
+            "ollama": llm_scheduler.get_stats(),
+            "index": index_publisher.get_status(),
+            "precompute": query_precomputer.get_stats()
         }
     }
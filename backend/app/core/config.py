@@ -3,7 +3,7 @@
 """
 import os
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic_settings import BaseSettings
 from pydantic import Field, validator
 
@@ -16,11 +16,18 @@ class Settings(BaseSettings):
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     
+    # 多进程部署
+    WORKERS: int = 1  # 大于1时启动1个写进程和WORKERS个读进程
+    INDEX_ROLE: str = "single"  # single | writer | reader
+    WRITER_PORT: int = 8100  # 写进程端口，文档入库等写操作发送到这里
+    
     # 数据目录
     BASE_DIR: Path = Path(__file__).parent.parent.parent
     DATA_DIR: Path = BASE_DIR / "data"
     UPLOAD_DIR: Path = DATA_DIR / "uploads"
     VECTOR_DB_DIR: Path = DATA_DIR / "vector_db"
+    CHUNK_STORE_DIR: Path = DATA_DIR / "chunk_store"
+    SNAPSHOT_DIR: Path = DATA_DIR / "snapshots"
     
     # 文档处理
     MAX_FILE_SIZE: int = 50 * 1024 * 1024  # 50MB
@@ -28,18 +35,70 @@ class Settings(BaseSettings):
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
     
+    # PDF提取
+    PDF_BACKEND: str = "pypdf2"  # pypdf2 | pymupdf（需单独安装，AGPL许可）| auto
+    PDF_WORKERS: int = 0  # 并行提取的进程数，0表示CPU核数
+    PDF_PARALLEL_MIN_PAGES: int = 64  # 页数达到该值才使用进程池
+    PDF_PAGES_PER_TASK: int = 16
+    PDF_CACHE_DIR: Path = DATA_DIR / "pdf_cache"
+    
     # 向量数据库
     VECTOR_DB_PROVIDER: str = "chroma"  # chroma | qdrant
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+    VECTOR_DB_RETIRE_DELAY: float = 60.0  # 切换集合后延迟删除旧集合（秒）
+    SNAPSHOT_BATCH_SIZE: int = 1000
+    INDEX_PUBLISH_DIR: Path = VECTOR_DB_DIR / "published"
+    INDEX_PUBLISH_DELAY: float = 5.0  # 写入后延迟发布，合并连续写入（秒）
+    INDEX_RELOAD_INTERVAL: float = 2.0  # 读进程检查新版本的间隔（秒）
+    INDEX_KEEP_VERSIONS: int = 3
+    INDEX_READER_WAIT: float = 120.0  # 读进程等待写进程开始发布的时间（秒），发布进行中时一直等待
     
     # Ollama配置
     OLLAMA_BASE_URL: str = "http://localhost:11434"
     OLLAMA_MODEL: str = "llama3.2"
     OLLAMA_EMBEDDING_MODEL: str = "nomic-embed-text"
+    OLLAMA_ENDPOINTS: List[str] = []  # 多个Ollama节点，为空时使用OLLAMA_BASE_URL
+    
+    # LLM调度配置
+    LLM_ENDPOINT_CONCURRENCY: int = 2  # 每个Ollama节点的并发数
+    LLM_MODEL_CONCURRENCY: Dict[str, int] = {}  # 按模型的并发上限
+    LLM_DEFAULT_MODEL_CONCURRENCY: int = 4
+    LLM_INTERACTIVE_RESERVED_SLOTS: int = 1  # 为交互请求保留的槽位
+    LLM_MAX_INTERACTIVE_QUEUE: int = 32
+    LLM_MAX_BATCH_QUEUE: int = 1024
+    LLM_QUEUE_TIMEOUT: float = 60.0  # 交互请求排队超时（秒）
+    LLM_BATCH_QUEUE_TIMEOUT: float = 1800.0  # 批处理（文档嵌入）排队超时（秒）
+    LLM_REQUEST_TIMEOUT: int = 300  # 单次Ollama HTTP请求超时（秒）
+    LLM_EMBED_BATCH_SIZE: int = 16
+    # 多进程部署时由主进程设置，写进程和读进程通过调度进程共用上述并发上限
+    LLM_SCHEDULER_ADDRESS: str = ""
+    LLM_SCHEDULER_AUTHKEY: str = ""
+    
+    # 领域配置
+    DOMAIN: str = "electric_vehicles"
+    DOMAIN_KEYWORDS: List[str] = [
+        "电动汽车", "新能源", "电池", "充电", "快充", "慢充", "充电桩", "换电",
+        "续航", "电机", "电控", "BMS", "能量密度", "能耗", "动能回收", "热管理"
+    ]
     
     # RAG配置
     SIMILARITY_TOP_K: int = 5
     SIMILARITY_THRESHOLD: float = 0.7
+    REQUEST_COALESCING_ENABLED: bool = True  # 合并相同的并发问题
+    
+    # 高频问题预计算
+    # 开启后用户问题原文会按天保存到 QUERY_LOG_DIR，只保留 PRECOMPUTE_WINDOW_DAYS 天
+    QUERY_LOG_ENABLED: bool = True
+    QUERY_LOG_DIR: Path = DATA_DIR / "query_log"
+    QUERY_LOG_QUEUE_SIZE: int = 10000  # 待写入的查询上限，写入跟不上时丢弃
+    PRECOMPUTE_ENABLED: bool = True
+    PRECOMPUTE_PATH: Path = DATA_DIR / "precomputed_queries.json"
+    PRECOMPUTE_WINDOW_DAYS: int = 30  # 只统计最近的查询
+    PRECOMPUTE_MIN_COUNT: int = 3  # 进入预计算的最少出现次数
+    PRECOMPUTE_MAX_QUERIES: int = 500
+    PRECOMPUTE_MERGE_THRESHOLD: float = 0.95  # 嵌入余弦相似度不低于该值的问题合并为一簇
+    PRECOMPUTE_REFRESH_DELAY: float = 10.0  # 知识库变更后延迟刷新（秒），合并连续写入
+    PRECOMPUTE_RELOAD_INTERVAL: float = 2.0  # 检查预计算文件更新的间隔（秒）
     
     # 安全配置
     SECRET_KEY: str = "your-secret-key-change-in-production"
@@ -54,7 +113,7 @@ class Settings(BaseSettings):
         env_file_encoding = "utf-8"
         case_sensitive = True
     
-    @validator("DATA_DIR", "UPLOAD_DIR", "VECTOR_DB_DIR", pre=True)
+    @validator("DATA_DIR", "UPLOAD_DIR", "VECTOR_DB_DIR", "CHUNK_STORE_DIR", "SNAPSHOT_DIR", "PDF_CACHE_DIR", pre=True)
     def create_dirs(cls, v: Path) -> Path:
         """确保目录存在"""
         v.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,17 @@
+"""
+进程工具
+"""
+import os
+
+
+def process_alive(pid: int) -> bool:
+    """进程是否仍在运行（非POSIX系统上无法可靠判断，视为存活）"""
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
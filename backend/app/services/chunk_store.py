@@ -0,0 +1,364 @@
+"""
+电动汽车知识问答系统 - 列式文档块存储
+"""
+import json
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from loguru import logger
+
+import numpy as np
+
+from app.core.config import settings
+
+# 文档块表的列，每列一个定长二进制文件，按块ID（行号）寻址
+CHUNK_COLUMNS = {
+    "doc_id": np.uint32,
+    "start": np.uint32,
+    "end": np.uint32,
+    "page": np.int32,
+    "section": np.int32,
+}
+NO_PAGE = -1
+NO_SECTION = -1
+
+# 新增列在旧数据上的填充值
+_COLUMN_DEFAULTS = {
+    "page": NO_PAGE,
+    "section": NO_SECTION,
+}
+
+# 文档表中单独成列的字段，其余元数据存为JSON
+_DOCUMENT_FIELDS = ("filename", "extension", "size", "domain")
+
+
+class ChunkStore:
+    """文档表（SQLite）+ 内存映射的列式文档块表
+
+    向量库中每个块只保存 chunk_id / doc_id，文件名、页码、偏移、标题路径等信息
+    在格式化来源时按需解析，避免每个块重复保存整份文档元数据。
+    每个向量集合有自己的文档块存储，由 RAG 服务随集合一起打开和切换。
+    """
+
+    def __init__(self, store_dir: Path, read_only: bool = False):
+        self.store_dir = Path(store_dir)
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._columns: Dict[str, np.ndarray] = {}
+        self._documents: Dict[int, Dict[str, Any]] = {}
+        self._sections: Dict[int, List[str]] = {}
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """首次使用时再连接，只读实例在切换到发布目录前不会打开任何文件"""
+        if self._connection is None:
+            with self._lock:
+                if self._connection is None:
+                    self._connection = self._connect()
+        return self._connection
+
+    def _connect(self) -> sqlite3.Connection:
+        db_path = self.store_dir / "documents.db"
+        if self.read_only:
+            return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT,
+                extension TEXT,
+                size INTEGER,
+                domain TEXT,
+                metadata TEXT,
+                created_at REAL
+            )"""
+        )
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS sections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                doc_id INTEGER,
+                heading_path TEXT
+            )"""
+        )
+        connection.commit()
+        self._backfill_columns()
+        return connection
+
+    def close(self):
+        """关闭数据库连接并释放列映射（集合被替换后调用）"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            self._columns = {}
+
+    def _column_path(self, name: str) -> Path:
+        return self.store_dir / f"chunks.{name}.bin"
+
+    def _backfill_columns(self):
+        """为旧数据补齐新增的列"""
+        sizes = {}
+        for name, dtype in CHUNK_COLUMNS.items():
+            path = self._column_path(name)
+            if path.exists():
+                sizes[name] = path.stat().st_size // np.dtype(dtype).itemsize
+        if not sizes:
+            return
+
+        rows = min(sizes.values())
+        for name, dtype in CHUNK_COLUMNS.items():
+            if name not in sizes:
+                np.full(rows, _COLUMN_DEFAULTS[name], dtype=dtype).tofile(self._column_path(name))
+
+    def _stored_rows(self) -> int:
+        """磁盘上完整写入的行数（以最短的列为准）"""
+        rows = []
+        for name, dtype in CHUNK_COLUMNS.items():
+            path = self._column_path(name)
+            size = path.stat().st_size if path.exists() else 0
+            rows.append(size // np.dtype(dtype).itemsize)
+        return min(rows)
+
+    def _load_columns(self):
+        """重新映射列文件"""
+        rows = self._stored_rows()
+        columns = {}
+        for name, dtype in CHUNK_COLUMNS.items():
+            if rows == 0:
+                columns[name] = np.empty(0, dtype=dtype)
+            else:
+                columns[name] = np.memmap(
+                    self._column_path(name), dtype=dtype, mode="r", shape=(rows,)
+                )
+        self._columns = columns
+
+    def _columns_for(self, chunk_id: int) -> Optional[Dict[str, np.ndarray]]:
+        """返回覆盖该行的列映射，其他进程追加后需要重新映射
+
+        列映射只整体替换、不原地修改；持锁取得引用后，即使其他线程回滚或重新映射，
+        本次读取使用的仍是同一组完整的列。
+        """
+        with self._lock:
+            if not self._columns or chunk_id >= len(self._columns["doc_id"]):
+                self._load_columns()
+            columns = self._columns
+        if 0 <= chunk_id < len(columns["doc_id"]):
+            return columns
+        return None
+
+    def __len__(self) -> int:
+        return self._stored_rows()
+
+    def add_document(self, metadata: Optional[Dict[str, Any]] = None) -> int:
+        """登记文档，返回文档ID"""
+        metadata = dict(metadata or {})
+        fields = {name: metadata.pop(name, None) for name in _DOCUMENT_FIELDS}
+
+        with self._lock:
+            cursor = self._db.execute(
+                """INSERT INTO documents (filename, extension, size, domain, metadata, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (
+                    fields["filename"],
+                    fields["extension"],
+                    fields["size"],
+                    fields["domain"],
+                    json.dumps(metadata, ensure_ascii=False, default=str),
+                    time.time(),
+                )
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def add_sections(self, doc_id: int, heading_paths: Sequence[Sequence[str]]) -> List[int]:
+        """登记文档的章节标题路径，返回章节ID"""
+        section_ids = []
+        with self._lock:
+            for heading_path in heading_paths:
+                cursor = self._db.execute(
+                    "INSERT INTO sections (doc_id, heading_path) VALUES (?, ?)",
+                    (doc_id, json.dumps(list(heading_path), ensure_ascii=False))
+                )
+                section_ids.append(cursor.lastrowid)
+            self._db.commit()
+        return section_ids
+
+    def append_chunks(
+        self,
+        doc_id: int,
+        spans: Sequence[Tuple[int, int, Optional[int], Optional[int]]]
+    ) -> List[int]:
+        """追加文档块 (start, end, page, section_id)，返回分配的块ID"""
+        if not spans:
+            return []
+
+        values = {
+            "doc_id": [doc_id] * len(spans),
+            "start": [span[0] for span in spans],
+            "end": [span[1] for span in spans],
+            "page": [NO_PAGE if span[2] is None else span[2] for span in spans],
+            "section": [NO_SECTION if span[3] is None else span[3] for span in spans],
+        }
+
+        with self._lock:
+            first_id = self._stored_rows()
+            for name, dtype in CHUNK_COLUMNS.items():
+                path = self._column_path(name)
+                with open(path, "r+b" if path.exists() else "wb") as file:
+                    # 截断未完整写入的尾部，保证各列行数一致
+                    file.truncate(first_id * np.dtype(dtype).itemsize)
+                    file.seek(0, 2)
+                    file.write(np.asarray(values[name], dtype=dtype).tobytes())
+            self._load_columns()
+
+        return list(range(first_id, first_id + len(spans)))
+
+    def rollback(self, first_chunk_id: int, doc_ids: Sequence[int]):
+        """删除一次失败入库登记的文档、章节和块（块ID从 first_chunk_id 起）"""
+        with self._lock:
+            for name, dtype in CHUNK_COLUMNS.items():
+                path = self._column_path(name)
+                if path.exists():
+                    with open(path, "r+b") as file:
+                        file.truncate(min(first_chunk_id * np.dtype(dtype).itemsize, path.stat().st_size))
+            for doc_id in doc_ids:
+                self._db.execute("DELETE FROM sections WHERE doc_id = ?", (doc_id,))
+                self._db.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+                self._documents.pop(doc_id, None)
+            self._db.commit()
+            self._sections.clear()
+            self._columns = {}
+        logger.info(f"↩️ 已回滚 {len(doc_ids)} 个文档的登记记录")
+
+    def get_chunk(self, chunk_id: int) -> Optional[Dict[str, Any]]:
+        """读取一行文档块记录"""
+        columns = self._columns_for(chunk_id)
+        if columns is None:
+            return None
+
+        page = int(columns["page"][chunk_id])
+        section = int(columns["section"][chunk_id])
+        return {
+            "chunk_id": chunk_id,
+            "doc_id": int(columns["doc_id"][chunk_id]),
+            "start": int(columns["start"][chunk_id]),
+            "end": int(columns["end"][chunk_id]),
+            "page": None if page == NO_PAGE else page,
+            "section": None if section == NO_SECTION else section,
+        }
+
+    def get_document(self, doc_id: int) -> Optional[Dict[str, Any]]:
+        """读取文档元数据"""
+        document = self._documents.get(doc_id)
+        if document is not None:
+            return document
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT filename, extension, size, domain, metadata FROM documents WHERE id = ?",
+                (doc_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        document = dict(zip(_DOCUMENT_FIELDS, row[:4]))
+        document.update(json.loads(row[4] or "{}"))
+        document["doc_id"] = doc_id
+        self._documents[doc_id] = document
+        return document
+
+    def get_heading_path(self, section_id: int) -> List[str]:
+        """读取章节标题路径"""
+        heading_path = self._sections.get(section_id)
+        if heading_path is not None:
+            return heading_path
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT heading_path FROM sections WHERE id = ?", (section_id,)
+            ).fetchone()
+        heading_path = json.loads(row[0]) if row else []
+        self._sections[section_id] = heading_path
+        return heading_path
+
+    def resolve(self, chunk_id: int) -> Optional[Dict[str, Any]]:
+        """把块ID解析为完整的来源元数据"""
+        chunk = self.get_chunk(chunk_id)
+        if chunk is None:
+            return None
+
+        metadata = dict(self.get_document(chunk["doc_id"]) or {})
+        metadata.update(chunk)
+        section = metadata.pop("section")
+        metadata["heading_path"] = self.get_heading_path(section) if section is not None else []
+        return metadata
+
+    def document_count(self) -> int:
+        """已登记的文档数"""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def _backup_db(self, target_dir: Path):
+        """把文档表备份到目标目录（需持有锁）"""
+        backup = sqlite3.connect(str(target_dir / "documents.db"))
+        try:
+            self._db.backup(backup)
+            # 副本使用普通日志模式，只读打开时不依赖 -wal/-shm 文件
+            backup.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            backup.close()
+
+    def export_to(self, target_dir: Path):
+        """导出一致的副本到目标目录"""
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._backup_db(target_dir)
+            for name in CHUNK_COLUMNS:
+                path = self._column_path(name)
+                if path.exists():
+                    shutil.copyfile(path, target_dir / path.name)
+
+    def compact_to(self, target_dir: Path, keep_ids: Sequence[int]) -> Dict[int, int]:
+        """把仍被引用的块按原顺序重新编号写入目标目录，不再有块的文档和章节一并删除
+
+        返回旧块ID到新块ID的映射。
+        """
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._load_columns()
+            rows = len(self._columns["doc_id"])
+            keep = np.unique(np.asarray([i for i in keep_ids if 0 <= i < rows], dtype=np.int64))
+
+            self._backup_db(target_dir)
+            for name, dtype in CHUNK_COLUMNS.items():
+                np.asarray(self._columns[name][keep], dtype=dtype).tofile(target_dir / f"chunks.{name}.bin")
+            doc_ids = np.unique(self._columns["doc_id"][keep]).tolist()
+            section_ids = [
+                section for section in np.unique(self._columns["section"][keep]).tolist()
+                if section != NO_SECTION
+            ]
+
+        target = sqlite3.connect(str(target_dir / "documents.db"))
+        try:
+            target.execute("CREATE TEMP TABLE kept_documents (id INTEGER PRIMARY KEY)")
+            target.execute("CREATE TEMP TABLE kept_sections (id INTEGER PRIMARY KEY)")
+            target.executemany("INSERT INTO kept_documents VALUES (?)", ((doc_id,) for doc_id in doc_ids))
+            target.executemany("INSERT INTO kept_sections VALUES (?)", ((section,) for section in section_ids))
+            target.execute("DELETE FROM documents WHERE id NOT IN (SELECT id FROM kept_documents)")
+            target.execute("DELETE FROM sections WHERE id NOT IN (SELECT id FROM kept_sections)")
+            target.commit()
+            target.execute("VACUUM")
+        finally:
+            target.close()
+
+        return dict(zip(keep.tolist(), range(len(keep))))
+
@@ -2,18 +2,26 @@
 电动汽车知识问答系统 - 文档处理服务
 """
 import os
+import re
 import tempfile
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from loguru import logger
 
-import PyPDF2
 from docx import Document
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 import openpyxl
 from unstructured.partition.auto import partition
 
 from app.core.config import settings
-from app.services.rag_service import rag_service
+from app.services.rag_service import rag_service, ReadOnlyIndexError
+from app.services.pdf_backends import pdf_extractor, PDFExtractionError
+from app.services.text_splitter import Segment, join_segments, segments_from_text
+
+_MD_HEADING_RE = re.compile(r"^ {0,3}(#{1,6})\s+(.+?)(?:\s+#+)?\s*$")
+_DOCX_HEADING_STYLE_RE = re.compile(r"^(?:Heading|标题)\s*(\d+)$", re.IGNORECASE)
 
 class EVDocumentService:
     """电动汽车领域文档处理服务"""
@@ -25,6 +33,9 @@ class EVDocumentService:
     def process_document(self, file_path: str, metadata: Dict = None) -> Dict[str, Any]:
         """处理单个文档"""
         try:
+            # 只读工作进程在提取前就拒绝，避免白白解析大文件
+            rag_service.ensure_writable()
+            
             file_ext = Path(file_path).suffix.lower()
             
             if file_ext not in self.allowed_extensions:
@@ -42,8 +53,9 @@ class EVDocumentService:
                     "error": f"文件过大: {file_size}字节 (最大: {self.max_file_size}字节)"
                 }
             
-            # 提取文本内容
-            text_content = self._extract_text(file_path, file_ext)
+            # 提取结构化片段（标题、段落、表格、页码）
+            segments = self._extract_segments(file_path, file_ext)
+            text_content = join_segments(segments)
             
             if not text_content or len(text_content.strip()) < 10:
                 return {
@@ -51,30 +63,29 @@ class EVDocumentService:
                     "error": "文档内容为空或过短"
                 }
             
-            # 增强电动汽车领域内容
-            enhanced_content = self._enhance_ev_content(text_content)
-            
-            # 准备元数据
+            # 准备元数据（领域关键词记录在文档表中，不再拼接到正文里）
             doc_metadata = {
                 "filename": Path(file_path).name,
                 "extension": file_ext,
                 "size": file_size,
                 "domain": "electric_vehicles",
-                "processed": True
+                "processed": True,
+                "keywords": self._find_ev_keywords(text_content)
             }
             
             if metadata:
                 doc_metadata.update(metadata)
             
             # 添加到RAG知识库
-            success = rag_service.add_documents([enhanced_content], [doc_metadata])
+            success = rag_service.add_documents([segments], [doc_metadata])
             
             if success:
+                if file_ext == '.pdf':
+                    pdf_extractor.evict(file_path)
                 return {
                     "success": True,
                     "filename": Path(file_path).name,
                     "content_length": len(text_content),
-                    "enhanced_length": len(enhanced_content),
                     "metadata": doc_metadata,
                     "domain": "electric_vehicles"
                 }
@@ -84,6 +95,9 @@ class EVDocumentService:
                     "error": "添加到知识库失败"
                 }
                 
+        except ReadOnlyIndexError:
+            # 交给API层返回409
+            raise
         except Exception as e:
             logger.error(f"❌ 文档处理失败: {e}")
             return {
@@ -93,6 +107,10 @@ class EVDocumentService:
     
     def _extract_text(self, file_path: str, file_ext: str) -> str:
         """根据文件类型提取文本"""
+        return join_segments(self._extract_segments(file_path, file_ext))
+    
+    def _extract_segments(self, file_path: str, file_ext: str) -> List[Segment]:
+        """根据文件类型提取结构化片段"""
         try:
             if file_ext == '.pdf':
                 return self._extract_pdf(file_path)
@@ -108,77 +126,151 @@ class EVDocumentService:
                 # 使用unstructured作为后备方案
                 return self._extract_with_unstructured(file_path)
                 
+        except PDFExtractionError:
+            # 保留可断点续传的提示，由 process_document 返回给用户
+            raise
         except Exception as e:
             logger.error(f"❌ 文本提取失败 ({file_ext}): {e}")
-            return ""
+            return []
+    
+    def _extract_pdf(self, file_path: str) -> List[Segment]:
+        """提取PDF文本，片段带页码"""
+        segments = []
+        for page_num, page_text in enumerate(self._extract_pdf_pages(file_path), start=1):
+            segments.extend(segments_from_text(page_text, page=page_num))
+        return segments
     
-    def _extract_pdf(self, file_path: str) -> str:
-        """提取PDF文本"""
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n\n"
-        return text
+    def _extract_pdf_pages(self, file_path: str) -> List[str]:
+        """逐页提取PDF文本（后端、并行度和页面缓存由 PDF_* 配置控制）"""
+        return pdf_extractor.extract_pages(file_path)
     
-    def _extract_docx(self, file_path: str) -> str:
-        """提取DOCX文本"""
+    def _extract_docx(self, file_path: str) -> List[Segment]:
+        """按文档顺序提取DOCX的标题、段落和表格"""
         doc = Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        segments = []
+        
+        for child in doc.element.body.iterchildren():
+            if child.tag == qn('w:p'):
+                paragraph = Paragraph(child, doc)
+                text = paragraph.text.strip()
+                if not text:
+                    continue
+                level = self._docx_heading_level(paragraph)
+                if level:
+                    segments.append(Segment(text=text, kind="heading", level=level))
+                else:
+                    segments.append(Segment(text=text))
+            elif child.tag == qn('w:tbl'):
+                table = Table(child, doc)
+                rows = [" | ".join(cell.text.strip() for cell in row.cells) for row in table.rows]
+                text = "\n".join(row for row in rows if row.strip(" |"))
+                if text:
+                    segments.append(Segment(text=text, kind="table"))
+        
+        return segments
+    
+    @staticmethod
+    def _docx_heading_level(paragraph: Paragraph) -> int:
+        """根据段落样式判断标题级别，非标题返回0"""
+        style_name = paragraph.style.name if paragraph.style is not None else ""
+        if style_name == "Title":
+            return 1
+        match = _DOCX_HEADING_STYLE_RE.match(style_name)
+        return int(match.group(1)) if match else 0
     
-    def _extract_txt(self, file_path: str) -> str:
+    def _extract_txt(self, file_path: str) -> List[Segment]:
         """提取TXT文本"""
         with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
+            return segments_from_text(file.read())
     
-    def _extract_excel(self, file_path: str) -> str:
-        """提取Excel文本"""
-        text = ""
+    def _extract_excel(self, file_path: str) -> List[Segment]:
+        """提取Excel文本，每个工作表为一个章节"""
+        segments = []
         workbook = openpyxl.load_workbook(file_path, read_only=True)
         
         for sheet_name in workbook.sheetnames:
             sheet = workbook[sheet_name]
-            text += f"工作表: {sheet_name}\n"
+            segments.append(Segment(text=f"工作表: {sheet_name}", kind="heading", level=1))
             
+            rows = []
             for row in sheet.iter_rows(values_only=True):
                 row_text = " | ".join(str(cell) for cell in row if cell)
                 if row_text:
-                    text += row_text + "\n"
+                    rows.append(row_text)
             
-            text += "\n"
+            if rows:
+                segments.append(Segment(text="\n".join(rows), kind="table"))
         
-        return text
+        return segments
     
-    def _extract_markdown(self, file_path: str) -> str:
-        """提取Markdown文本"""
+    def _extract_markdown(self, file_path: str) -> List[Segment]:
+        """提取Markdown文本，识别标题、表格和代码块"""
         with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
-    
-    def _extract_with_unstructured(self, file_path: str) -> str:
-        """使用unstructured提取文本"""
-        elements = partition(filename=file_path)
-        text = "\n".join(str(element) for element in elements)
-        return text
-    
-    def _enhance_ev_content(self, content: str) -> str:
-        """增强电动汽车领域内容"""
-        enhanced = content
+            lines = file.read().splitlines()
         
-        # 添加领域标识
-        enhanced = f"[电动汽车领域文档]\n{enhanced}"
+        segments = []
+        block: List[str] = []
+        block_kind = "paragraph"
+        in_code = False
         
-        # 检查是否包含电动汽车关键词
-        ev_keywords = settings.DOMAIN_KEYWORDS
-        found_keywords = [kw for kw in ev_keywords if kw in content]
+        def flush_block():
+            text = "\n".join(block).strip()
+            if text:
+                segments.append(Segment(text=text, kind=block_kind))
+            block.clear()
         
-        if found_keywords:
-            enhanced += f"\n\n[关键词]: {', '.join(found_keywords)}"
+        for line in lines:
+            stripped = line.strip()
+            
+            # 代码块内的 # 不是标题
+            if stripped.startswith("```") or stripped.startswith("~~~"):
+                in_code = not in_code
+                block.append(line)
+                continue
+            if in_code:
+                block.append(line)
+                continue
+            
+            heading = _MD_HEADING_RE.match(line)
+            if heading:
+                flush_block()
+                segments.append(Segment(
+                    text=heading.group(2), kind="heading", level=len(heading.group(1))
+                ))
+                continue
+            
+            if not stripped:
+                flush_block()
+                continue
+            
+            kind = "table" if stripped.startswith("|") else "paragraph"
+            if block and kind != block_kind:
+                flush_block()
+            block_kind = kind
+            block.append(line)
         
-        return enhanced
+        flush_block()
+        return segments
+    
+    def _extract_with_unstructured(self, file_path: str) -> List[Segment]:
+        """使用unstructured提取文本"""
+        segments = []
+        for element in partition(filename=file_path):
+            text = str(element).strip()
+            if not text:
+                continue
+            category = getattr(element, "category", "")
+            if category == "Title":
+                segments.append(Segment(text=text, kind="heading", level=1))
+            elif category == "Table":
+                segments.append(Segment(text=text, kind="table"))
+            else:
+                segments.append(Segment(text=text))
+        return segments
+    
+    def _find_ev_keywords(self, content: str) -> List[str]:
+        """查找文档中出现的电动汽车关键词"""
+        return [kw for kw in settings.DOMAIN_KEYWORDS if kw in content]
     
     def batch_process(self, file_paths: List[str], metadata_list: List[Dict] = None) -> Dict[str, Any]:
         """批量处理文档"""
@@ -0,0 +1,258 @@
+"""
+电动汽车知识问答系统 - 多进程索引发布与加载
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+from loguru import logger
+
+from app.core.config import settings
+from app.core.process import process_alive
+from app.services.rag_service import rag_service, PUBLISHED_MANIFEST, PUBLISHED_SEGMENTS_DIR
+from app.services.vector_store_manager import vector_store_manager
+
+PUBLISH_FORMAT = 1
+# 指向最新发布版本的文件，原子替换
+PUBLISHED_POINTER = "PUBLISHED"
+# 写进程发布期间存在，内容为写进程的进程号；读进程据此决定是否继续等待首个版本
+PUBLISHING_MARKER = "PUBLISHING"
+
+
+class IndexPublisher:
+    """写进程把知识库发布为只读版本，读进程轮询并加载最新版本
+
+    向量以不可变的段（segments/ 下的 float32 矩阵 + 记录文件）发布，每次发布只写入
+    上次发布之后新增的块；版本目录只包含引用这些段的清单和文档块存储的副本。
+    读进程直接内存映射共享的段，不复制也不加载私有索引，多个读进程共用同一份页缓存。
+    清空、恢复或压缩切换集合后，下一次发布重新导出整个集合。
+    """
+
+    def __init__(self):
+        self.publish_dir = settings.INDEX_PUBLISH_DIR
+        self.segments_dir = self.publish_dir / PUBLISHED_SEGMENTS_DIR
+        self.loaded_version: Optional[str] = None
+        self._manifest: Optional[Dict[str, Any]] = None
+        self._publish_lock = threading.Lock()
+        self._publish_timer: Optional[threading.Timer] = None
+        self._timer_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def published_version(self) -> Optional[str]:
+        """最新发布的版本号"""
+        pointer = self.publish_dir / PUBLISHED_POINTER
+        if not pointer.exists():
+            return None
+        return pointer.read_text(encoding="utf-8").strip() or None
+
+    def _read_manifest(self, version: Optional[str]) -> Optional[Dict[str, Any]]:
+        if version is None:
+            return None
+        path = self.publish_dir / version / PUBLISHED_MANIFEST
+        if not path.exists():
+            return None
+        manifest = json.loads(path.read_text(encoding="utf-8"))
+        return manifest if manifest.get("format") == PUBLISH_FORMAT else None
+
+    # ---------- 写进程 ----------
+
+    def start_writer(self):
+        """写进程启动：在上次发布的基础上发布当前版本，并在知识库变更后自动发布"""
+        if not rag_service.is_initialized():
+            rag_service.initialize()
+        self._cleanup_staging()
+        self._manifest = self._read_manifest(self.published_version())
+        rag_service.add_change_listener(self.schedule_publish)
+        self.publish()
+
+    def _cleanup_staging(self):
+        """删除上次退出时未完成的临时目录"""
+        for parent in (self.publish_dir, self.segments_dir):
+            if parent.exists():
+                for path in parent.glob(".*.tmp"):
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def schedule_publish(self):
+        """延迟发布，合并短时间内的多次写入"""
+        with self._timer_lock:
+            if self._publish_timer is not None:
+                return
+            self._publish_timer = threading.Timer(settings.INDEX_PUBLISH_DELAY, self._scheduled_publish)
+            self._publish_timer.daemon = True
+            self._publish_timer.start()
+
+    def _scheduled_publish(self):
+        with self._timer_lock:
+            self._publish_timer = None
+        try:
+            self.publish()
+        except Exception as e:
+            logger.error(f"❌ 发布索引失败: {e}")
+
+    def publish(self) -> str:
+        """发布当前知识库的新版本"""
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        marker = self.publish_dir / PUBLISHING_MARKER
+        with self._publish_lock:
+            marker.write_text(str(os.getpid()), encoding="utf-8")
+            try:
+                return self._publish()
+            finally:
+                marker.unlink(missing_ok=True)
+
+    def _publish(self) -> str:
+        started = time.time()
+        version = f"v{time.time_ns()}"
+        staging = self.publish_dir / f".{version}.tmp"
+
+        # 写锁内只取一致的状态（块数、版本号、文档块存储副本），向量在锁外读取
+        with rag_service.write_lock:
+            index = rag_service.serving
+            rows = len(index.chunk_store)
+            index_version = index.version()
+            index.chunk_store.export_to(staging / "chunk_store")
+
+        previous = self._manifest
+        if previous and previous["collection"] == index.collection_dir.name and previous["rows"] <= rows:
+            segments, start = list(previous["segments"]), previous["rows"]
+        else:
+            segments, start = [], None
+
+        exported = 0
+        try:
+            collection = index.vector_store._collection
+            if start is None or start < rows:
+                exported = vector_store_manager.export_segment(collection, self.segments_dir / version, rows, start)
+                segments.append(version)
+
+            manifest = {
+                "format": PUBLISH_FORMAT,
+                "collection": index.collection_dir.name,
+                "rows": rows,
+                "index_version": index_version,
+                "space": (collection.metadata or {}).get("hnsw:space", "l2"),
+                "segments": segments,
+            }
+            (staging / PUBLISHED_MANIFEST).write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        os.replace(staging, self.publish_dir / version)
+
+        pointer = self.publish_dir / PUBLISHED_POINTER
+        tmp_pointer = pointer.with_suffix(".tmp")
+        tmp_pointer.write_text(version, encoding="utf-8")
+        os.replace(tmp_pointer, pointer)
+        self._manifest = manifest
+
+        self._prune()
+        kind = "全量" if start is None else "增量"
+        logger.info(
+            f"📢 已发布索引版本: {version}（{kind}导出 {exported} 个文档块，"
+            f"共 {len(segments)} 段，{time.time() - started:.1f}秒）"
+        )
+        return version
+
+    def _prune(self):
+        """只保留最近的几个版本及其引用的段，给仍在切换中的读进程留出余量"""
+        versions = sorted(
+            path for path in self.publish_dir.iterdir()
+            if path.is_dir() and path.name.startswith("v")
+        )
+        for path in versions[:-settings.INDEX_KEEP_VERSIONS]:
+            shutil.rmtree(path, ignore_errors=True)
+
+        referenced = set()
+        for path in versions[-settings.INDEX_KEEP_VERSIONS:]:
+            manifest = self._read_manifest(path.name)
+            if manifest:
+                referenced.update(manifest["segments"])
+        for path in self.segments_dir.iterdir():
+            if path.is_dir() and not path.name.startswith(".") and path.name not in referenced:
+                shutil.rmtree(path, ignore_errors=True)
+
+    # ---------- 读进程 ----------
+
+    def _writer_publishing(self) -> bool:
+        """写进程是否正在发布"""
+        try:
+            pid = int((self.publish_dir / PUBLISHING_MARKER).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+        return process_alive(pid)
+
+    def start_reader(self):
+        """读进程启动：等待并加载最新版本，然后在后台轮询新版本
+
+        首次全量发布的耗时与知识库大小成正比，写进程发布期间一直等待；
+        INDEX_READER_WAIT 只限制等待写进程启动的时间。
+        """
+        deadline = time.monotonic() + settings.INDEX_READER_WAIT
+        version = self.published_version()
+        while version is None:
+            if self._writer_publishing():
+                deadline = time.monotonic() + settings.INDEX_READER_WAIT
+            elif time.monotonic() > deadline:
+                raise RuntimeError("等待写进程发布索引超时")
+            time.sleep(0.5)
+            version = self.published_version()
+
+        self._load(version)
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _load(self, version: str):
+        """加载指定版本：映射其向量段，与该版本的文档块存储一起原子切换"""
+        version_dir = self.publish_dir / version
+        manifest = self._read_manifest(version)
+        if manifest is None:
+            raise RuntimeError(f"索引版本 {version} 缺少清单或格式不兼容")
+
+        # 预计算结果按写进程的知识库版本匹配
+        if rag_service.is_initialized():
+            old = rag_service.swap_vector_store(
+                version_dir,
+                update_pointer=False,
+                chunk_store_dir=version_dir / "chunk_store",
+                published_version=manifest["index_version"],
+            )
+            rag_service.retire_collection(old)
+        else:
+            rag_service.initialize(version_dir, version_dir / "chunk_store", manifest["index_version"])
+
+        self.loaded_version = version
+        logger.info(f"📥 已加载索引版本: {version}")
+
+    def _watch(self):
+        while not self._stop.wait(settings.INDEX_RELOAD_INTERVAL):
+            version = self.published_version()
+            if version is None or version == self.loaded_version:
+                continue
+            try:
+                self._load(version)
+            except Exception as e:
+                logger.error(f"❌ 加载索引版本 {version} 失败: {e}")
+
+    def stop(self):
+        """停止后台轮询，并立即发布尚未发布的变更"""
+        self._stop.set()
+        with self._timer_lock:
+            pending = self._publish_timer is not None
+            if pending:
+                self._publish_timer.cancel()
+                self._publish_timer = None
+        if pending:
+            self.publish()
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取索引发布状态"""
+        return {
+            "role": settings.INDEX_ROLE,
+            "published_version": self.published_version(),
+            "loaded_version": self.loaded_version,
+        }
+
+# 全局索引发布实例
+index_publisher = IndexPublisher()
@@ -0,0 +1,354 @@
+"""
+电动汽车知识问答系统 - Ollama请求调度器
+"""
+import bisect
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from multiprocessing.managers import BaseManager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from loguru import logger
+
+from app.core.config import settings
+from app.core.process import process_alive
+
+# 调度进程检查槽位持有进程是否已退出的间隔（秒）
+OWNER_CHECK_INTERVAL = 5.0
+
+
+class LLMPriority(IntEnum):
+    """请求优先级，数值越小越优先"""
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class SchedulerOverloaded(Exception):
+    """队列已满，请求被拒绝"""
+
+    def __init__(self, priority: LLMPriority, queue_position: int, retry_after: float):
+        self.priority = priority
+        self.queue_position = queue_position
+        self.retry_after = retry_after
+        super().__init__(
+            f"LLM队列已满 ({priority.name.lower()}), 排队位置: {queue_position}, "
+            f"建议 {retry_after:.0f} 秒后重试"
+        )
+
+    def __reduce__(self):
+        # 从调度进程传回工作进程时按原参数重建
+        return type(self), (self.priority, self.queue_position, self.retry_after)
+
+
+class SchedulerTimeout(Exception):
+    """排队等待超时"""
+
+
+@dataclass(order=True)
+class _Ticket:
+    """一个排队中的请求"""
+    priority: int
+    seq: int
+    model: str = field(compare=False)
+    endpoint: Optional[str] = field(default=None, compare=False)
+    owner: Optional[int] = field(default=None, compare=False)
+    granted_at: float = field(default=0.0, compare=False)
+
+
+class LLMScheduler:
+    """所有Ollama请求的中心调度器：优先级队列、按模型限流、多节点最少负载路由"""
+
+    def __init__(
+        self,
+        endpoints: List[str],
+        endpoint_concurrency: int,
+        model_concurrency: Dict[str, int],
+        default_model_concurrency: int,
+        max_queue: Dict[LLMPriority, int],
+        interactive_reserved_slots: int = 0,
+        queue_timeout: Optional[Dict[LLMPriority, float]] = None,
+    ):
+        self.endpoints = list(dict.fromkeys(endpoints))
+        self.endpoint_concurrency = endpoint_concurrency
+        self.model_concurrency = dict(model_concurrency)
+        self.default_model_concurrency = default_model_concurrency
+        self.max_queue = dict(max_queue)
+        # 至少留一个槽位给批处理，避免批处理永远无法执行
+        self.interactive_reserved_slots = max(0, min(interactive_reserved_slots, self.capacity - 1))
+        # 按优先级的排队超时，批处理让位于交互请求，需要更长的等待时间
+        self.queue_timeout = {priority: 60.0 for priority in LLMPriority}
+        self.queue_timeout.update(queue_timeout or {})
+
+        self._condition = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[_Ticket] = []
+        self._granted: Dict[int, _Ticket] = {}
+        self._endpoint_inflight: Dict[str, int] = {url: 0 for url in self.endpoints}
+        self._model_inflight: Dict[str, int] = {}
+        self._rejected = 0
+        self._timed_out = 0
+        self._completed = 0
+        # 平均服务时长（指数滑动平均），用于估算重试时间
+        self._avg_service_time = 1.0
+
+    @property
+    def capacity(self) -> int:
+        """所有节点的总并发数"""
+        return len(self.endpoints) * self.endpoint_concurrency
+
+    def _model_limit(self, model: str) -> int:
+        return self.model_concurrency.get(model, self.default_model_concurrency)
+
+    def _queue_position(self, priority: LLMPriority) -> int:
+        """在同优先级及更高优先级请求之后的排队位置"""
+        return sum(1 for ticket in self._waiting if ticket.priority <= priority) + 1
+
+    def _pick_endpoint(self, priority: int) -> Optional[str]:
+        """选择负载最低的节点，批处理请求不能占用为交互请求保留的槽位"""
+        if priority != LLMPriority.INTERACTIVE:
+            total_inflight = sum(self._endpoint_inflight.values())
+            if total_inflight >= self.capacity - self.interactive_reserved_slots:
+                return None
+
+        endpoint = min(self.endpoints, key=lambda url: self._endpoint_inflight[url])
+        if self._endpoint_inflight[endpoint] >= self.endpoint_concurrency:
+            return None
+        return endpoint
+
+    def _dispatch(self):
+        """按优先级顺序为排队请求分配节点（需持有锁）"""
+        granted = False
+        for ticket in list(self._waiting):
+            if self._model_inflight.get(ticket.model, 0) >= self._model_limit(ticket.model):
+                continue
+
+            endpoint = self._pick_endpoint(ticket.priority)
+            if endpoint is None:
+                if ticket.priority == LLMPriority.INTERACTIVE:
+                    break
+                continue
+
+            ticket.endpoint = endpoint
+            ticket.granted_at = time.monotonic()
+            self._granted[ticket.seq] = ticket
+            self._endpoint_inflight[endpoint] += 1
+            self._model_inflight[ticket.model] = self._model_inflight.get(ticket.model, 0) + 1
+            self._waiting.remove(ticket)
+            granted = True
+
+        if granted:
+            self._condition.notify_all()
+
+    def acquire_slot(
+        self,
+        model: str,
+        priority: LLMPriority = LLMPriority.INTERACTIVE,
+        timeout: Optional[float] = None,
+        owner: Optional[int] = None,
+    ) -> Tuple[int, str]:
+        """申请一个执行槽位，返回票据号和分配到的Ollama节点地址，用完后调用 release_slot
+
+        owner 为持有槽位的进程号，该进程退出而未释放时由 release_dead_owners 回收。
+        """
+        timeout = self.queue_timeout[priority] if timeout is None else timeout
+
+        with self._condition:
+            queued = sum(1 for ticket in self._waiting if ticket.priority == priority)
+            if queued >= self.max_queue.get(priority, 0):
+                position = self._queue_position(priority)
+                self._rejected += 1
+                retry_after = self._avg_service_time * position / max(self.capacity, 1)
+                raise SchedulerOverloaded(priority, position, max(retry_after, 1.0))
+
+            ticket = _Ticket(priority=int(priority), seq=next(self._seq), model=model, owner=owner)
+            bisect.insort(self._waiting, ticket)
+            self._dispatch()
+
+            deadline = time.monotonic() + timeout
+            while ticket.endpoint is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self._timed_out += 1
+                    raise SchedulerTimeout(f"LLM请求排队超时 ({timeout:.0f}秒, 模型: {model})")
+                self._condition.wait(remaining)
+
+        return ticket.seq, ticket.endpoint
+
+    def release_slot(self, seq: int, completed: bool = True):
+        """释放槽位并调度排队中的请求"""
+        with self._condition:
+            ticket = self._granted.pop(seq, None)
+            if ticket is None:
+                return
+            self._endpoint_inflight[ticket.endpoint] -= 1
+            self._model_inflight[ticket.model] -= 1
+            if completed:
+                elapsed = time.monotonic() - ticket.granted_at
+                self._completed += 1
+                self._avg_service_time = 0.9 * self._avg_service_time + 0.1 * elapsed
+            self._dispatch()
+
+    def release_dead_owners(self) -> int:
+        """回收已退出的进程仍持有的槽位，返回回收数量"""
+        with self._condition:
+            dead = [
+                seq for seq, ticket in self._granted.items()
+                if ticket.owner is not None and not process_alive(ticket.owner)
+            ]
+        for seq in dead:
+            self.release_slot(seq, completed=False)
+        return len(dead)
+
+    @contextmanager
+    def acquire(
+        self,
+        model: str,
+        priority: LLMPriority = LLMPriority.INTERACTIVE,
+        timeout: Optional[float] = None,
+    ) -> Iterator[str]:
+        """申请一个执行槽位，返回分配到的Ollama节点地址"""
+        seq, endpoint = self.acquire_slot(model, priority, timeout)
+        try:
+            yield endpoint
+        finally:
+            self.release_slot(seq)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度器状态"""
+        with self._condition:
+            return {
+                "endpoints": dict(self._endpoint_inflight),
+                "models": dict(self._model_inflight),
+                "queued": {
+                    priority.name.lower(): sum(
+                        1 for ticket in self._waiting if ticket.priority == priority
+                    )
+                    for priority in LLMPriority
+                },
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "avg_service_time": round(self._avg_service_time, 3),
+            }
+
+
+class _SchedulerManager(BaseManager):
+    """在独立的调度进程中托管调度器，多进程部署的所有工作进程通过它申请槽位"""
+
+
+_served_scheduler: Optional[LLMScheduler] = None
+_served_lock = threading.Lock()
+
+
+def _serve_scheduler() -> LLMScheduler:
+    """调度进程内唯一的调度器，首次连接时创建，并定期回收已退出进程持有的槽位"""
+    global _served_scheduler
+    with _served_lock:
+        if _served_scheduler is None:
+            _served_scheduler = _create_local_scheduler()
+            threading.Thread(target=_reap_dead_owners, args=(_served_scheduler,), daemon=True).start()
+        return _served_scheduler
+
+
+def _reap_dead_owners(scheduler: LLMScheduler):
+    while True:
+        time.sleep(OWNER_CHECK_INTERVAL)
+        released = scheduler.release_dead_owners()
+        if released:
+            logger.warning(f"⚠️ 回收了已退出进程持有的 {released} 个LLM槽位")
+
+
+_SchedulerManager.register(
+    "scheduler", callable=_serve_scheduler, exposed=("acquire_slot", "release_slot", "get_stats")
+)
+
+
+class SharedLLMScheduler:
+    """多进程部署时工作进程使用的调度器：槽位由主进程启动的调度进程统一分配
+
+    写进程和所有读进程共用同一套节点/模型并发上限和优先级队列，
+    写进程的批量嵌入与读进程的交互请求在同一队列中排序，Ollama 看到的并发不随进程数增加。
+    """
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes):
+        self.address = address
+        self._authkey = authkey
+        self._lock = threading.Lock()
+        self._scheduler = None
+
+    def _remote(self):
+        """首次使用时连接调度进程（代理对象在每个线程中使用各自的连接）"""
+        with self._lock:
+            if self._scheduler is None:
+                manager = _SchedulerManager(address=self.address, authkey=self._authkey)
+                manager.connect()
+                self._scheduler = manager.scheduler()
+            return self._scheduler
+
+    @contextmanager
+    def acquire(
+        self,
+        model: str,
+        priority: LLMPriority = LLMPriority.INTERACTIVE,
+        timeout: Optional[float] = None,
+    ) -> Iterator[str]:
+        """申请一个执行槽位，返回分配到的Ollama节点地址"""
+        scheduler = self._remote()
+        seq, endpoint = scheduler.acquire_slot(model, priority, timeout, os.getpid())
+        try:
+            yield endpoint
+        finally:
+            scheduler.release_slot(seq)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度进程中的全局状态"""
+        return self._remote().get_stats()
+
+
+def start_scheduler_server() -> _SchedulerManager:
+    """启动调度进程，并把地址写入环境变量，随后启动的写进程和读进程都连接到它"""
+    authkey = os.urandom(16)
+    manager = _SchedulerManager(address=("127.0.0.1", 0), authkey=authkey)
+    manager.start()
+    host, port = manager.address
+    os.environ["LLM_SCHEDULER_ADDRESS"] = f"{host}:{port}"
+    os.environ["LLM_SCHEDULER_AUTHKEY"] = authkey.hex()
+    logger.info(f"🚦 LLM调度进程已启动: {host}:{port}")
+    return manager
+
+
+def _create_local_scheduler() -> LLMScheduler:
+    """根据配置创建进程内调度器"""
+    endpoints = settings.OLLAMA_ENDPOINTS or [settings.OLLAMA_BASE_URL]
+    logger.info(f"🚦 LLM调度器: {len(endpoints)} 个Ollama节点")
+    return LLMScheduler(
+        endpoints=endpoints,
+        endpoint_concurrency=settings.LLM_ENDPOINT_CONCURRENCY,
+        model_concurrency=settings.LLM_MODEL_CONCURRENCY,
+        default_model_concurrency=settings.LLM_DEFAULT_MODEL_CONCURRENCY,
+        max_queue={
+            LLMPriority.INTERACTIVE: settings.LLM_MAX_INTERACTIVE_QUEUE,
+            LLMPriority.BATCH: settings.LLM_MAX_BATCH_QUEUE,
+        },
+        interactive_reserved_slots=settings.LLM_INTERACTIVE_RESERVED_SLOTS,
+        queue_timeout={
+            LLMPriority.INTERACTIVE: settings.LLM_QUEUE_TIMEOUT,
+            LLMPriority.BATCH: settings.LLM_BATCH_QUEUE_TIMEOUT,
+        },
+    )
+
+
+def _create_scheduler():
+    """多进程部署时连接共用的调度进程，否则使用进程内调度器"""
+    if settings.LLM_SCHEDULER_ADDRESS:
+        host, port = settings.LLM_SCHEDULER_ADDRESS.rsplit(":", 1)
+        logger.info(f"🚦 LLM调度器: 共用调度进程 {settings.LLM_SCHEDULER_ADDRESS}")
+        return SharedLLMScheduler((host, int(port)), bytes.fromhex(settings.LLM_SCHEDULER_AUTHKEY))
+    return _create_local_scheduler()
+
+# 全局调度器实例
+llm_scheduler = _create_scheduler()
@@ -0,0 +1,306 @@
+"""
+电动汽车知识问答系统 - PDF提取后端
+"""
+import hashlib
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from loguru import logger
+
+import PyPDF2
+
+try:
+    import fitz  # PyMuPDF，可选的快速解析器
+except ImportError:
+    fitz = None
+
+from app.core.config import settings
+
+
+class PDFExtractionError(RuntimeError):
+    """部分页面提取失败，已提取的页面保留在缓存中，重试时从断点继续"""
+
+
+class PDFBackend(ABC):
+    """PDF提取后端，页码从0开始"""
+
+    name = ""
+
+    @abstractmethod
+    def page_count(self, file_path: str) -> int:
+        """PDF的页数"""
+
+    @abstractmethod
+    def extract_pages(self, file_path: str, page_numbers: Sequence[int]) -> Dict[int, str]:
+        """提取指定页面的文本，返回 {页码: 文本}"""
+
+
+class PyPDF2Backend(PDFBackend):
+    """纯Python实现，无需额外依赖"""
+
+    name = "pypdf2"
+
+    def page_count(self, file_path: str) -> int:
+        return len(PyPDF2.PdfReader(file_path).pages)
+
+    def extract_pages(self, file_path: str, page_numbers: Sequence[int]) -> Dict[int, str]:
+        reader = PyPDF2.PdfReader(file_path)
+        return {number: reader.pages[number].extract_text() or "" for number in page_numbers}
+
+
+class PyMuPDFBackend(PDFBackend):
+    """基于MuPDF的快速解析器，按版面阅读顺序输出文本块（不做OCR）"""
+
+    name = "pymupdf"
+
+    def page_count(self, file_path: str) -> int:
+        with fitz.open(file_path) as document:
+            return document.page_count
+
+    def extract_pages(self, file_path: str, page_numbers: Sequence[int]) -> Dict[int, str]:
+        pages = {}
+        with fitz.open(file_path) as document:
+            for number in page_numbers:
+                blocks = document.load_page(number).get_text("blocks", sort=True)
+                # 每个文本块作为一个段落，跳过图片块
+                pages[number] = "\n\n".join(
+                    block[4].strip() for block in blocks
+                    if block[6] == 0 and block[4].strip()
+                )
+        return pages
+
+
+_BACKENDS = {
+    PyPDF2Backend.name: PyPDF2Backend,
+    PyMuPDFBackend.name: PyMuPDFBackend,
+}
+
+
+def get_backend(name: str) -> PDFBackend:
+    """按名称获取后端，auto 优先使用已安装的快速解析器"""
+    if name == "auto":
+        name = PyMuPDFBackend.name if fitz is not None else PyPDF2Backend.name
+    if name == PyMuPDFBackend.name and fitz is None:
+        logger.warning("⚠️ 未安装PyMuPDF，回退到PyPDF2")
+        name = PyPDF2Backend.name
+    if name not in _BACKENDS:
+        raise ValueError(f"不支持的PDF后端: {name}")
+    return _BACKENDS[name]()
+
+
+class _PageWorkerPool:
+    """常驻的页面提取进程池，所有PDF共用，首次并行提取时启动
+
+    子进程以 app.services.pdf_worker 为入口，只导入PDF解析后端；multiprocessing 的 spawn
+    会在子进程中重新导入服务的 main.py，连带加载向量库、LangChain 和各个全局实例。
+    每个子进程由一个线程负责收发任务，子进程异常退出时只有当前任务失败，下一个任务重新启动。
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._tasks: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def map(self, backend_name: str, file_path: str,
+            tasks: List[List[int]]) -> Iterator[Tuple[List[int], Any]]:
+        """提交一组任务，按完成顺序返回 (页码列表, 结果或异常)"""
+        with self._lock:
+            if not self._threads:
+                self._threads = [
+                    threading.Thread(target=self._serve, daemon=True) for _ in range(self.workers)
+                ]
+                for thread in self._threads:
+                    thread.start()
+
+        results: "queue.Queue[Tuple[List[int], Any]]" = queue.Queue()
+        for task in tasks:
+            self._tasks.put((backend_name, file_path, task, results))
+        for _ in tasks:
+            yield results.get()
+
+    @staticmethod
+    def _start_process() -> subprocess.Popen:
+        return subprocess.Popen(
+            [sys.executable, "-m", "app.services.pdf_worker"],
+            cwd=Path(__file__).resolve().parents[2],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def _serve(self):
+        process = None
+        while True:
+            item = self._tasks.get()
+            if item is None:
+                break
+            backend_name, file_path, task, results = item
+            try:
+                if process is None:
+                    process = self._start_process()
+                request = {"backend": backend_name, "file": file_path, "pages": task}
+                process.stdin.write(json.dumps(request).encode("utf-8") + b"\n")
+                process.stdin.flush()
+                line = process.stdout.readline()
+                if not line:
+                    raise RuntimeError(f"PDF提取进程异常退出 (退出码 {process.wait()})")
+            except Exception as e:
+                if process is not None:
+                    process.kill()
+                    process.wait()
+                    process = None
+                results.put((task, e))
+                continue
+
+            response = json.loads(line)
+            if "error" in response:
+                results.put((task, RuntimeError(response["error"])))
+            else:
+                results.put((task, {int(number): text for number, text in response["pages"].items()}))
+
+        if process is not None:
+            process.stdin.close()
+            process.wait()
+
+    def close(self):
+        """结束所有子进程"""
+        with self._lock:
+            for _ in self._threads:
+                self._tasks.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+
+class PDFExtractor:
+    """按页提取PDF：大文件的页面分配到进程池并行处理，结果按内容哈希逐页缓存
+
+    导入中途失败时，已提取的页面保留在缓存中，重试只处理剩余页面；
+    导入成功后由调用方清除该文件的缓存。
+    """
+
+    def __init__(
+        self,
+        backend: str,
+        workers: int,
+        parallel_min_pages: int,
+        pages_per_task: int,
+        cache_dir: Path,
+    ):
+        self.backend_name = backend
+        self.workers = workers or os.cpu_count() or 1
+        self.parallel_min_pages = parallel_min_pages
+        self.pages_per_task = pages_per_task
+        self.cache_dir = Path(cache_dir)
+        self._pool = _PageWorkerPool(self.workers)
+
+    @staticmethod
+    def _file_digest(file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _page_cache_path(cache_dir: Path, number: int) -> Path:
+        return cache_dir / f"{number:05d}.txt"
+
+    def _store_pages(self, cache_dir: Path, pages: Dict[int, str]):
+        """逐页写入缓存（先写临时文件再替换）"""
+        for number, text in pages.items():
+            path = self._page_cache_path(cache_dir, number)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text(text, encoding="utf-8")
+            tmp_path.replace(path)
+
+    def extract_pages(self, file_path: str) -> List[str]:
+        """提取所有页面的文本"""
+        backend = get_backend(self.backend_name)
+        cache_dir = self.cache_dir / self._file_digest(file_path) / backend.name
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        page_count = backend.page_count(file_path)
+        pages: Dict[int, str] = {}
+        missing = []
+        for number in range(page_count):
+            path = self._page_cache_path(cache_dir, number)
+            if path.exists():
+                pages[number] = path.read_text(encoding="utf-8")
+            else:
+                missing.append(number)
+
+        if missing:
+            if pages:
+                logger.info(f"♻️ 从缓存恢复 {len(pages)} 页，继续提取剩余 {len(missing)} 页")
+            tasks = [
+                missing[start:start + self.pages_per_task]
+                for start in range(0, len(missing), self.pages_per_task)
+            ]
+            if self.workers > 1 and len(missing) >= self.parallel_min_pages:
+                failed = self._extract_parallel(backend.name, file_path, tasks, cache_dir, pages)
+            else:
+                failed = self._extract_serial(backend, file_path, tasks, cache_dir, pages)
+
+            if failed:
+                raise PDFExtractionError(
+                    f"{failed} 页提取失败（已缓存 {len(pages)}/{page_count} 页，重试时将从断点继续）"
+                )
+
+        return [pages[number] for number in range(page_count)]
+
+    def evict(self, file_path: str):
+        """导入成功后删除该文件的页面缓存（缓存只用于失败后续传）"""
+        cache_dir = self.cache_dir / self._file_digest(file_path)
+        if cache_dir.exists():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def _extract_serial(self, backend: PDFBackend, file_path: str, tasks: List[List[int]],
+                        cache_dir: Path, pages: Dict[int, str]) -> int:
+        failed = 0
+        for task in tasks:
+            try:
+                result = backend.extract_pages(file_path, task)
+            except Exception as e:
+                logger.error(f"❌ PDF页面 {task[0] + 1}-{task[-1] + 1} 提取失败: {e}")
+                failed += len(task)
+                continue
+            self._store_pages(cache_dir, result)
+            pages.update(result)
+        return failed
+
+    def _extract_parallel(self, backend_name: str, file_path: str, tasks: List[List[int]],
+                          cache_dir: Path, pages: Dict[int, str]) -> int:
+        logger.info(
+            f"⚡ 使用 {min(self.workers, len(tasks))} 个进程并行提取 {sum(map(len, tasks))} 页 ({backend_name})"
+        )
+
+        failed = 0
+        for task, result in self._pool.map(backend_name, os.path.abspath(file_path), tasks):
+            if isinstance(result, Exception):
+                logger.error(f"❌ PDF页面 {task[0] + 1}-{task[-1] + 1} 提取失败: {result}")
+                failed += len(task)
+                continue
+            self._store_pages(cache_dir, result)
+            pages.update(result)
+        return failed
+
+    def close(self):
+        """服务关闭时结束进程池"""
+        self._pool.close()
+
+# 全局PDF提取实例
+pdf_extractor = PDFExtractor(
+    backend=settings.PDF_BACKEND,
+    workers=settings.PDF_WORKERS,
+    parallel_min_pages=settings.PDF_PARALLEL_MIN_PAGES,
+    pages_per_task=settings.PDF_PAGES_PER_TASK,
+    cache_dir=settings.PDF_CACHE_DIR,
+)
@@ -0,0 +1,29 @@
+"""
+电动汽车知识问答系统 - PDF页面提取子进程入口
+
+由 PDFExtractor 的常驻进程池以 `python -m app.services.pdf_worker` 启动，只导入PDF解析后端。
+任务和结果通过标准输入输出传递，每行一个JSON。
+"""
+import json
+import sys
+
+from app.services.pdf_backends import get_backend
+
+
+def main():
+    output = sys.stdout
+    # 解析库打印的内容不能混入结果
+    sys.stdout = sys.stderr
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            pages = get_backend(request["backend"]).extract_pages(request["file"], request["pages"])
+            response = {"pages": {str(number): text for number, text in pages.items()}}
+        except Exception as e:
+            response = {"error": f"{type(e).__name__}: {e}"}
+        output.write(json.dumps(response) + "\n")
+        output.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+电动汽车知识问答系统 - 读进程共享的内存映射向量索引
+"""
+import json
+import mmap
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+SEGMENT_META = "segment.json"
+
+
+class SegmentWriter:
+    """把记录追加写成一个不可变的段：float32 向量矩阵、向量范数和按偏移寻址的记录文件
+
+    先写入同目录下的临时目录，close() 时原子改名，读进程只会看到完整的段。
+    """
+
+    def __init__(self, segment_dir: Path):
+        self.segment_dir = Path(segment_dir)
+        self._tmp_dir = self.segment_dir.with_name(f".{self.segment_dir.name}.tmp")
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        self._tmp_dir.mkdir(parents=True)
+        self._vectors = open(self._tmp_dir / "vectors.f32", "wb")
+        self._records = open(self._tmp_dir / "records.jsonl", "wb")
+        self._norms: List[np.ndarray] = []
+        self._offsets = [0]
+        self.count = 0
+        self.dimension = 0
+
+    def add(
+        self,
+        ids: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        documents: Sequence[str],
+        metadatas: Sequence[Optional[Dict[str, Any]]]
+    ):
+        """追加一批记录"""
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        self.dimension = vectors.shape[1]
+        self._vectors.write(vectors.tobytes())
+        self._norms.append(np.linalg.norm(vectors, axis=1).astype(np.float32))
+        for record_id, document, metadata in zip(ids, documents, metadatas):
+            line = json.dumps(
+                {"id": record_id, "document": document, "metadata": metadata or {}},
+                ensure_ascii=False
+            ).encode("utf-8") + b"\n"
+            self._records.write(line)
+            self._offsets.append(self._offsets[-1] + len(line))
+        self.count += len(ids)
+
+    def close(self) -> int:
+        """写完范数和偏移并发布段，返回记录数"""
+        self._vectors.close()
+        self._records.close()
+        norms = np.concatenate(self._norms) if self._norms else np.empty(0, dtype=np.float32)
+        norms.tofile(self._tmp_dir / "norms.f32")
+        np.asarray(self._offsets, dtype=np.uint64).tofile(self._tmp_dir / "offsets.u64")
+        (self._tmp_dir / SEGMENT_META).write_text(
+            json.dumps({"count": self.count, "dimension": self.dimension}), encoding="utf-8"
+        )
+        os.replace(self._tmp_dir, self.segment_dir)
+        return self.count
+
+
+class _Segment:
+    """只读映射的段，多个读进程映射同一文件时共享页缓存"""
+
+    def __init__(self, segment_dir: Path):
+        meta = json.loads((segment_dir / SEGMENT_META).read_text(encoding="utf-8"))
+        self.count = meta["count"]
+        self.dimension = meta["dimension"]
+        if self.count == 0:
+            return
+        self.vectors = np.memmap(
+            segment_dir / "vectors.f32", dtype=np.float32, mode="r", shape=(self.count, self.dimension)
+        )
+        self.norms = np.memmap(segment_dir / "norms.f32", dtype=np.float32, mode="r", shape=(self.count,))
+        self.offsets = np.memmap(segment_dir / "offsets.u64", dtype=np.uint64, mode="r", shape=(self.count + 1,))
+        with open(segment_dir / "records.jsonl", "rb") as file:
+            self._records = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def document(self, row: int) -> Document:
+        record = json.loads(self._records[int(self.offsets[row]):int(self.offsets[row + 1])])
+        return Document(page_content=record["document"], metadata=record["metadata"])
+
+
+class PublishedVectorStore(VectorStore):
+    """读进程使用的只读向量库：逐段暴力检索内存映射的向量矩阵
+
+    距离与 chromadb 的 hnsw:space 一致（l2 为平方欧氏距离，ip / cosine 为 1 - 相似度），
+    同一段被所有读进程映射，不需要各自复制或加载索引。
+    """
+
+    def __init__(self, segment_dirs: Iterable[Path], embedding_function: Embeddings, space: str = "l2"):
+        self._embedding_function = embedding_function
+        self.space = space
+        self.segments = [segment for segment in map(_Segment, segment_dirs) if segment.count]
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def count(self) -> int:
+        """记录总数"""
+        return sum(segment.count for segment in self.segments)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("发布的索引是只读的")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   **kwargs: Any) -> "PublishedVectorStore":
+        raise NotImplementedError("发布的索引由写进程生成")
+
+    def _distances(self, segment: _Segment, query: np.ndarray) -> np.ndarray:
+        dots = np.asarray(segment.vectors @ query)
+        if self.space == "ip":
+            return 1.0 - dots
+        if self.space == "cosine":
+            return 1.0 - dots / np.maximum(np.asarray(segment.norms) * np.linalg.norm(query), 1e-12)
+        return np.asarray(segment.norms) ** 2 + float(query @ query) - 2.0 * dots
+
+    def similarity_search_by_vector_with_relevance_scores(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """返回距离最小的 k 个文档及距离"""
+        query = np.asarray(embedding, dtype=np.float32)
+        candidates = []
+        for segment in self.segments:
+            distances = self._distances(segment, query)
+            rows = np.argpartition(distances, k)[:k] if len(distances) > k else np.arange(len(distances))
+            candidates.extend((float(distances[row]), segment, int(row)) for row in rows)
+        candidates.sort(key=lambda candidate: candidate[0])
+        return [(segment.document(row), distance) for distance, segment, row in candidates[:k]]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_relevance_scores(
+            self._embedding_function.embed_query(query), k
+        )
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
@@ -0,0 +1,372 @@
+"""
+电动汽车知识问答系统 - 高频问题的检索预计算
+"""
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.request_coalescer import normalize_question
+
+PRECOMPUTE_FORMAT = 1
+
+# 查询日志按天分文件，超出统计窗口的整个文件直接删除
+_LOG_FILE_RE = re.compile(r"^queries-(\d{8})\.jsonl$")
+
+# 模板化问题中不影响检索意图的虚词、语气词和标点
+_FILLER_RE = re.compile(r"[\W_]+|请问|一下|的|了|吗|呢|啊|呀|吧")
+
+
+def canonicalize_question(question: str) -> str:
+    """问题的规范形式，措辞略有不同的同一模板问题得到相同结果"""
+    return _FILLER_RE.sub("", normalize_question(question))
+
+
+class QueryPrecomputer:
+    """挖掘查询日志中的高频问题簇，预先计算其嵌入与 top-k 检索结果
+
+    离线任务（python manage.py precompute）统计查询日志，按规范形式聚类，
+    再用嵌入相似度合并同义的簇；命中的问题在回答时跳过嵌入和向量检索。
+    知识库变更后只用保存的嵌入重新检索，不需要重新挖掘或嵌入。
+    预计算文件记录计算时的知识库版本，只有与当前服务的版本一致时才使用。
+    """
+
+    def __init__(self, log_dir: Path, data_path: Path):
+        self.log_dir = Path(log_dir)
+        self.data_path = Path(data_path)
+        self._lock = threading.Lock()
+        self._clusters: List[Dict[str, Any]] = []
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._loaded_mtime: Optional[float] = None
+        self._checked_at = 0.0
+        # 预计算结果对应的知识库版本
+        self._data_version: Optional[str] = None
+        self._refresh_timer: Optional[threading.Timer] = None
+        self._timer_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # 查询日志由后台线程批量写入，请求路径只入队
+        self._log_queue: queue.Queue = queue.Queue(maxsize=settings.QUERY_LOG_QUEUE_SIZE)
+        self._log_thread: Optional[threading.Thread] = None
+        self._log_thread_lock = threading.Lock()
+        self._trimmed_day: Optional[str] = None
+        self.dropped_queries = 0
+
+    # ---------- 查询日志 ----------
+
+    def log_query(self, question: str):
+        """记录一条查询（不阻塞请求，队列满时丢弃）"""
+        if not settings.QUERY_LOG_ENABLED:
+            return
+        self._ensure_log_writer()
+        try:
+            self._log_queue.put_nowait((time.time(), question))
+        except queue.Full:
+            self.dropped_queries += 1
+
+    def _ensure_log_writer(self):
+        if self._log_thread is not None:
+            return
+        with self._log_thread_lock:
+            if self._log_thread is None:
+                self._log_thread = threading.Thread(
+                    target=self._write_log_loop, name="query-log-writer", daemon=True
+                )
+                self._log_thread.start()
+
+    def _write_log_loop(self):
+        """后台线程：取出已入队的记录，按天追加到日志文件（多进程追加写入，每条一行）"""
+        while True:
+            records = [self._log_queue.get()]
+            while True:
+                try:
+                    records.append(self._log_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines_by_file: Dict[Path, List[str]] = defaultdict(list)
+            for ts, question in records:
+                line = json.dumps({"ts": ts, "question": question}, ensure_ascii=False) + "\n"
+                lines_by_file[self._log_file(ts)].append(line)
+            try:
+                self.log_dir.mkdir(parents=True, exist_ok=True)
+                for path, lines in lines_by_file.items():
+                    with open(path, "a", encoding="utf-8") as file:
+                        file.write("".join(lines))
+                # 每天清理一次超出窗口的日志
+                today = time.strftime("%Y%m%d")
+                if self._trimmed_day != today:
+                    self.trim_log()
+                    self._trimmed_day = today
+            except OSError as e:
+                logger.warning(f"⚠️ 写入查询日志失败: {e}")
+
+    def _log_file(self, ts: float) -> Path:
+        return self.log_dir / f"queries-{time.strftime('%Y%m%d', time.localtime(ts))}.jsonl"
+
+    def _log_files(self) -> Dict[str, Path]:
+        """日期 -> 日志文件"""
+        if not self.log_dir.exists():
+            return {}
+        files = {}
+        for path in self.log_dir.iterdir():
+            match = _LOG_FILE_RE.match(path.name)
+            if match:
+                files[match.group(1)] = path
+        return files
+
+    @staticmethod
+    def _window_start() -> str:
+        return time.strftime("%Y%m%d", time.localtime(time.time() - settings.PRECOMPUTE_WINDOW_DAYS * 86400))
+
+    def trim_log(self) -> int:
+        """删除早于统计窗口的日志文件，返回删除的文件数"""
+        window_start = self._window_start()
+        removed = 0
+        for day, path in self._log_files().items():
+            if day < window_start:
+                path.unlink(missing_ok=True)
+                removed += 1
+        if removed:
+            logger.info(f"🧹 已删除 {removed} 个超出统计窗口的查询日志文件")
+        return removed
+
+    def mine_clusters(self) -> List[Dict[str, Any]]:
+        """统计时间窗口内的查询，返回按频次排序的候选簇"""
+        self.trim_log()
+        since = time.time() - settings.PRECOMPUTE_WINDOW_DAYS * 86400
+        counts: Counter = Counter()
+        phrasings: Dict[str, Counter] = defaultdict(Counter)
+        for _, path in sorted(self._log_files().items()):
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 跳过并发写入时可能产生的残缺行
+                        continue
+                    if record.get("ts", 0) < since:
+                        continue
+                    canonical = canonicalize_question(record.get("question", ""))
+                    if not canonical:
+                        continue
+                    counts[canonical] += 1
+                    phrasings[canonical][record["question"].strip()] += 1
+
+        return [
+            {
+                "question": phrasings[canonical].most_common(1)[0][0],
+                "members": [canonical],
+                "count": count,
+            }
+            for canonical, count in counts.most_common(settings.PRECOMPUTE_MAX_QUERIES)
+            if count >= settings.PRECOMPUTE_MIN_COUNT
+        ]
+
+    @staticmethod
+    def _keyword_set(question: str) -> frozenset:
+        return frozenset(keyword for keyword in settings.DOMAIN_KEYWORDS if keyword in question)
+
+    def _merge_similar(self, candidates: List[Dict[str, Any]], embeddings: np.ndarray) -> List[Dict[str, Any]]:
+        """贪心合并嵌入相近且领域关键词相同的簇（candidates 已按频次降序）
+
+        要求关键词一致，避免把“电池寿命”和“电机寿命”这类仅差一个术语的问题合并。
+        """
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        unit = embeddings / np.maximum(norms, 1e-12)
+
+        clusters, heads = [], []
+        for i, candidate in enumerate(candidates):
+            keywords = self._keyword_set(candidate["question"])
+            for cluster, head in zip(clusters, heads):
+                if (cluster["keywords"] == keywords
+                        and float(unit[head] @ unit[i]) >= settings.PRECOMPUTE_MERGE_THRESHOLD):
+                    cluster["members"].extend(candidate["members"])
+                    cluster["count"] += candidate["count"]
+                    break
+            else:
+                clusters.append({**candidate, "keywords": keywords, "embedding": embeddings[i]})
+                heads.append(i)
+        return clusters
+
+    # ---------- 预计算 ----------
+
+    def build(self, rag_service) -> Dict[str, Any]:
+        """离线任务：挖掘高频问题簇，计算嵌入和检索结果并保存"""
+        if not rag_service.is_initialized():
+            rag_service.initialize()
+
+        started = time.time()
+        index = rag_service.serving
+        index_version = index.version()
+        candidates = self.mine_clusters()
+        if not candidates:
+            self._save([], index_version)
+            logger.info("📭 查询日志中没有达到阈值的高频问题")
+            return {"clusters": 0, "queries": 0}
+
+        # 与在线问答一致，对增强后的问题做嵌入；离线任务走批量优先级
+        enhanced = [rag_service._enhance_question(candidate["question"]) for candidate in candidates]
+        embeddings = np.asarray(rag_service.embeddings.embed_documents(enhanced), dtype=np.float32)
+
+        clusters = self._merge_similar(candidates, embeddings)
+        for cluster in clusters:
+            cluster["keywords"] = sorted(cluster["keywords"])
+            cluster["embedding"] = cluster["embedding"].tolist()
+            cluster["results"] = self._search(index, cluster["embedding"])
+            cluster["refreshed_at"] = time.time()
+
+        if not self._save_if_current(rag_service, clusters, index_version):
+            return {"clusters": 0, "queries": 0, "skipped": True}
+        covered = sum(cluster["count"] for cluster in clusters)
+        logger.info(
+            f"🧮 已预计算 {len(clusters)} 个高频问题簇（覆盖 {covered} 次查询，"
+            f"{time.time() - started:.1f}秒）"
+        )
+        return {"clusters": len(clusters), "queries": covered, "candidates": len(candidates)}
+
+    @staticmethod
+    def _search(index, embedding: List[float]) -> List[Dict[str, Any]]:
+        """用保存的嵌入直接检索，不再调用嵌入模型"""
+        results = index.vector_store.similarity_search_by_vector_with_relevance_scores(
+            embedding, k=settings.SIMILARITY_TOP_K
+        )
+        return [
+            {"content": doc.page_content, "metadata": doc.metadata, "score": float(score)}
+            for doc, score in results
+        ]
+
+    def refresh(self, rag_service) -> Dict[str, Any]:
+        """知识库变更后增量刷新：只重新检索，不重新挖掘或嵌入"""
+        started = time.time()
+        index = rag_service.serving
+        index_version = index.version()
+        self._reload(force=True)
+        with self._lock:
+            clusters = [dict(cluster) for cluster in self._clusters]
+
+        for cluster in clusters:
+            cluster["results"] = self._search(index, cluster["embedding"])
+            cluster["refreshed_at"] = time.time()
+
+        if not self._save_if_current(rag_service, clusters, index_version):
+            return {"clusters": 0, "skipped": True}
+        logger.info(f"🔄 已刷新 {len(clusters)} 个预计算问题的检索结果 ({time.time() - started:.1f}秒)")
+        return {"clusters": len(clusters)}
+
+    def _save_if_current(self, rag_service, clusters: List[Dict[str, Any]], index_version: Optional[str]) -> bool:
+        """检索期间知识库没有变化才保存；有变化时由变更触发的下一次刷新处理"""
+        if rag_service.index_version() != index_version:
+            logger.info("⏭️ 检索期间知识库已变更，跳过保存预计算结果")
+            return False
+        self._save(clusters, index_version)
+        return True
+
+    def schedule_refresh(self, rag_service):
+        """知识库变更回调：延迟刷新以合并连续写入（版本变化后旧结果自动停用）"""
+        with self._timer_lock:
+            if self._refresh_timer is not None:
+                return
+            self._refresh_timer = threading.Timer(
+                settings.PRECOMPUTE_REFRESH_DELAY, self._scheduled_refresh, args=(rag_service,)
+            )
+            self._refresh_timer.daemon = True
+            self._refresh_timer.start()
+
+    def _scheduled_refresh(self, rag_service):
+        with self._timer_lock:
+            self._refresh_timer = None
+        try:
+            self.refresh(rag_service)
+        except Exception as e:
+            logger.error(f"❌ 刷新预计算结果失败: {e}")
+
+    # ---------- 持久化 ----------
+
+    def _save(self, clusters: List[Dict[str, Any]], index_version: Optional[str]):
+        """写入预计算文件（先写临时文件再原子替换）"""
+        data = {
+            "format": PRECOMPUTE_FORMAT,
+            "embedding_model": settings.OLLAMA_EMBEDDING_MODEL,
+            "top_k": settings.SIMILARITY_TOP_K,
+            "index_version": index_version,
+            "built_at": time.time(),
+            "clusters": clusters,
+        }
+        self.data_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.data_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.data_path)
+        self._reload(force=True)
+
+    def _reload(self, force: bool = False):
+        """预计算文件变化时重新加载（其他进程刷新后自动生效）"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < settings.PRECOMPUTE_RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+
+        try:
+            mtime = self.data_path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if not force and mtime == self._loaded_mtime:
+            return
+
+        data = json.loads(self.data_path.read_text(encoding="utf-8"))
+        clusters = data.get("clusters", [])
+        # 嵌入模型或 top_k 改变后旧结果不再可用，等待重新运行离线任务
+        if (data.get("format") != PRECOMPUTE_FORMAT
+                or data.get("embedding_model") != settings.OLLAMA_EMBEDDING_MODEL
+                or data.get("top_k") != settings.SIMILARITY_TOP_K):
+            logger.warning("⚠️ 预计算文件与当前配置不一致，已忽略")
+            clusters = []
+
+        index = {member: cluster for cluster in clusters for member in cluster["members"]}
+        with self._lock:
+            self._clusters = clusters
+            self._index = index
+            self._loaded_mtime = mtime
+            self._data_version = data.get("index_version")
+
+    # ---------- 在线查询 ----------
+
+    def lookup(self, question: str, index_version: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        """返回问题命中的预计算检索结果，未命中或结果不是按 index_version 计算的时返回 None"""
+        if not settings.PRECOMPUTE_ENABLED:
+            return None
+        try:
+            self._reload()
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ 加载预计算文件失败: {e}")
+
+        cluster = self._index.get(canonicalize_question(question))
+        if cluster is None or index_version is None or self._data_version != index_version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cluster["results"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取预计算命中统计"""
+        total = self.hits + self.misses
+        return {
+            "clusters": len(self._clusters),
+            "index_version": self._data_version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "dropped_queries": self.dropped_queries,
+        }
+
+# 全局高频问题预计算实例
+query_precomputer = QueryPrecomputer(settings.QUERY_LOG_DIR, settings.PRECOMPUTE_PATH)
@@ -1,59 +1,145 @@
 """
 电动汽车知识问答系统 - RAG服务
 """
+import json
 import os
-from typing import List, Dict, Any, Optional
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Iterator, Union, Callable
 from pathlib import Path
 from loguru import logger
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # 非POSIX系统上不检查向量库的占用
+
+from chromadb.api.client import SharedSystemClient
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_community.llms import Ollama
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from langchain.memory import ConversationBufferMemory
+from langchain_core.vectorstores import VectorStore
 
 from app.core.config import settings
+from app.services.request_coalescer import request_coalescer, normalize_question
+from app.services.llm_scheduler import SchedulerOverloaded, SchedulerTimeout
+from app.services.scheduled_ollama import ScheduledOllama, ScheduledOllamaEmbeddings
+from app.services.chunk_store import ChunkStore
+from app.services.published_index import PublishedVectorStore
+from app.services.text_splitter import Segment, StructuredTextSplitter
+from app.services.query_precompute import query_precomputer
+
+COLLECTION_NAME = "ev_knowledge_base"
+DEFAULT_COLLECTION_DIR = "ev_knowledge"
+# 指向当前使用的集合目录，切换集合时原子替换
+CURRENT_POINTER = "CURRENT"
+# 发布版本目录中的清单，以及各版本共享的向量段目录（位于发布目录下）
+PUBLISHED_MANIFEST = "manifest.json"
+PUBLISHED_SEGMENTS_DIR = "segments"
+# 修改向量库目录的进程（服务或命令行工具）持有该文件上的排他锁
+OWNER_LOCK = ".owner.lock"
+
+
+class ReadOnlyIndexError(RuntimeError):
+    """只读工作进程不能修改知识库"""
+
+
+class VectorDBBusyError(RuntimeError):
+    """向量库目录已被另一个进程占用"""
+
+
+def release_chroma_client(persist_directory: Path):
+    """停止chromadb为该目录缓存的客户端系统，释放内存中的索引
+
+    chromadb 按持久化目录全局缓存客户端，切换走的集合不释放会一直占用内存。
+    """
+    system = SharedSystemClient._identifer_to_system.pop(str(persist_directory), None)
+    if system is not None:
+        system.stop()
+
+
+@dataclass(frozen=True)
+class ServingIndex:
+    """一起切换的向量集合、检索链和文档块存储
+
+    查询开始时取一次引用，之后的检索和来源解析都只使用这一组对象；
+    切换集合时整体替换，进行中的查询不会用新的块表解析旧集合中的块ID。
+    """
+    collection_dir: Path
+    vector_store: VectorStore
+    qa_chain: RetrievalQA
+    chunk_store: ChunkStore
+    # 读进程：所加载发布版本记录的写进程知识库版本
+    published_version: Optional[str] = None
+
+    def version(self) -> str:
+        """知识库状态的版本：集合目录 + 块数
+
+        块ID只追加，重建集合（清空、恢复、压缩）时目录改变，因此同一版本对应同一份内容。
+        """
+        if self.published_version is not None:
+            return self.published_version
+        return f"{self.collection_dir.name}:{len(self.chunk_store)}"
+
 
 class EVRAGService:
     """电动汽车领域RAG服务"""
     
     def __init__(self):
-        self.vector_store = None
-        self.qa_chain = None
+        self.embeddings = None
+        self.serving: Optional[ServingIndex] = None
+        self.llm = None
+        self.prompt_template = None
         self.initialized = False
         self.ev_keywords = settings.DOMAIN_KEYWORDS
+        self.text_splitter = StructuredTextSplitter(
+            chunk_size=settings.CHUNK_SIZE,
+            chunk_overlap=settings.CHUNK_OVERLAP
+        )
+        # 写操作（入库、清空、压缩、恢复）互斥，读操作不受影响
+        self.write_lock = threading.RLock()
+        # 多进程部署时读进程只加载写进程发布的索引
+        self.read_only = settings.INDEX_ROLE == "reader"
+        self._change_listeners: List[Callable[[], None]] = []
+        # 被替换的集合等待进行中的查询结束后再删除；命令行工具没有查询，设为0立即删除
+        self.retire_delay = settings.VECTOR_DB_RETIRE_DELAY
+        self._retire_timers: List[threading.Timer] = []
+        self._owner_lock = None
+        if not self.read_only:
+            # 知识库变更后重新检索预计算的高频问题
+            self.add_change_listener(lambda: query_precomputer.schedule_refresh(self))
         
-    def initialize(self):
-        """初始化RAG系统"""
+    def initialize(
+        self,
+        collection_dir: Optional[Path] = None,
+        chunk_store_dir: Optional[Path] = None,
+        published_version: Optional[str] = None
+    ):
+        """初始化RAG系统，collection_dir 默认为当前集合目录
+
+        chunk_store_dir 默认为集合对应的文档块存储目录；读进程传入发布版本中的目录和版本号。
+        """
         try:
             logger.info("🚀 初始化电动汽车RAG系统...")
             
-            # 1. 初始化嵌入模型
-            embeddings = OllamaEmbeddings(
-                base_url=settings.OLLAMA_BASE_URL,
+            # 1. 初始化嵌入模型（所有Ollama请求经过调度器）
+            self.embeddings = ScheduledOllamaEmbeddings(
                 model=settings.OLLAMA_EMBEDDING_MODEL
             )
             
-            # 2. 初始化向量存储
-            vector_store_path = settings.VECTOR_DB_DIR / "ev_knowledge"
-            self.vector_store = Chroma(
-                persist_directory=str(vector_store_path),
-                embedding_function=embeddings,
-                collection_name="ev_knowledge_base"
-            )
-            
-            # 3. 初始化LLM
-            llm = Ollama(
-                base_url=settings.OLLAMA_BASE_URL,
+            # 2. 初始化LLM
+            self.llm = ScheduledOllama(
                 model=settings.OLLAMA_MODEL,
                 temperature=0.1,  # 降低温度以获得更准确的回答
                 num_predict=512  # 限制生成长度
             )
             
-            # 4. 创建电动汽车领域特定的提示模板
-            prompt_template = PromptTemplate(
+            # 3. 创建电动汽车领域特定的提示模板
+            self.prompt_template = PromptTemplate(
                 template="""你是一个电动汽车领域的专家助手。请基于以下上下文信息回答问题。
 
 上下文信息:
@@ -74,21 +160,12 @@ class EVRAGService:
                 input_variables=["context", "question", "keywords"]
             )
             
-            # 5. 创建检索QA链
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=self.vector_store.as_retriever(
-                    search_kwargs={"k": settings.SIMILARITY_TOP_K}
-                ),
-                chain_type_kwargs={
-                    "prompt": prompt_template,
-                    "verbose": True
-                },
-                return_source_documents=True
+            # 4. 打开向量集合和文档块存储，创建检索QA链
+            self.serving = self._open_index(
+                collection_dir or self.current_collection_dir(), chunk_store_dir, published_version
             )
             
-            # 6. 初始化对话记忆
+            # 5. 初始化对话记忆
             self.memory = ConversationBufferMemory(
                 memory_key="chat_history",
                 return_messages=True
@@ -101,47 +178,421 @@ class EVRAGService:
             logger.error(f"❌ RAG系统初始化失败: {e}")
             raise
     
+    def _open_vector_store(self, collection_dir: Path) -> VectorStore:
+        """打开指定目录下的向量集合，读进程打开发布版本目录中的内存映射索引"""
+        if self.read_only:
+            manifest = json.loads((collection_dir / PUBLISHED_MANIFEST).read_text(encoding="utf-8"))
+            return PublishedVectorStore(
+                (collection_dir.parent / PUBLISHED_SEGMENTS_DIR / name for name in manifest["segments"]),
+                self.embeddings,
+                space=manifest.get("space", "l2"),
+            )
+        return Chroma(
+            persist_directory=str(collection_dir),
+            embedding_function=self.embeddings,
+            collection_name=COLLECTION_NAME
+        )
+    
+    def _open_index(
+        self,
+        collection_dir: Path,
+        chunk_store_dir: Optional[Path] = None,
+        published_version: Optional[str] = None
+    ) -> ServingIndex:
+        """打开集合目录及其文档块存储"""
+        vector_store = self._open_vector_store(collection_dir)
+        return ServingIndex(
+            collection_dir=collection_dir,
+            vector_store=vector_store,
+            qa_chain=self._build_qa_chain(vector_store),
+            chunk_store=ChunkStore(
+                chunk_store_dir or self.chunk_store_dir(collection_dir), read_only=self.read_only
+            ),
+            published_version=published_version,
+        )
+    
+    @property
+    def collection_dir(self) -> Optional[Path]:
+        """当前集合目录"""
+        return self.serving.collection_dir if self.serving else None
+    
+    @property
+    def vector_store(self) -> Optional[VectorStore]:
+        """当前向量集合（查询应先取 serving，再使用其中的各个对象）"""
+        return self.serving.vector_store if self.serving else None
+    
+    @property
+    def qa_chain(self) -> Optional[RetrievalQA]:
+        """当前检索QA链"""
+        return self.serving.qa_chain if self.serving else None
+    
+    @property
+    def chunk_store(self) -> Optional[ChunkStore]:
+        """当前集合的文档块存储"""
+        return self.serving.chunk_store if self.serving else None
+    
+    def _build_qa_chain(self, vector_store: VectorStore) -> RetrievalQA:
+        """基于向量存储创建检索QA链"""
+        return RetrievalQA.from_chain_type(
+            llm=self.llm,
+            chain_type="stuff",
+            retriever=vector_store.as_retriever(
+                search_kwargs={"k": settings.SIMILARITY_TOP_K}
+            ),
+            chain_type_kwargs={
+                "prompt": self.prompt_template,
+                "verbose": True
+            },
+            return_source_documents=True
+        )
+    
+    @staticmethod
+    def current_collection_dir() -> Path:
+        """当前使用的集合目录"""
+        pointer = settings.VECTOR_DB_DIR / CURRENT_POINTER
+        name = pointer.read_text(encoding="utf-8").strip() if pointer.exists() else ""
+        return settings.VECTOR_DB_DIR / (name or DEFAULT_COLLECTION_DIR)
+    
+    @staticmethod
+    def new_collection_dir() -> Path:
+        """为重建的集合分配一个新的版本目录"""
+        version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        return settings.VECTOR_DB_DIR / f"{DEFAULT_COLLECTION_DIR}-{version}"
+    
+    @staticmethod
+    def chunk_store_dir(collection_dir: Path) -> Path:
+        """集合对应的文档块存储目录，默认集合沿用 CHUNK_STORE_DIR 以兼容已有数据"""
+        if collection_dir.name == DEFAULT_COLLECTION_DIR:
+            return settings.CHUNK_STORE_DIR
+        return settings.CHUNK_STORE_DIR / collection_dir.name
+    
+    def swap_vector_store(
+        self,
+        collection_dir: Path,
+        update_pointer: bool = True,
+        chunk_store_dir: Optional[Path] = None,
+        published_version: Optional[str] = None
+    ) -> ServingIndex:
+        """原子切换到另一个集合目录，返回被替换的 ServingIndex
+
+        新集合和对应的文档块存储先完整打开，再用一次赋值整体替换；
+        进行中的查询继续使用它们取得的旧集合和旧块表，不会中断。
+        调用方需事先写好文档块存储目录。读进程加载发布版本时不更新 CURRENT 指针。
+        """
+        if not self.initialized:
+            self.initialize()
+        
+        serving = self._open_index(collection_dir, chunk_store_dir, published_version)
+        
+        if update_pointer:
+            pointer = settings.VECTOR_DB_DIR / CURRENT_POINTER
+            tmp_pointer = pointer.with_suffix(".tmp")
+            tmp_pointer.write_text(collection_dir.name, encoding="utf-8")
+            os.replace(tmp_pointer, pointer)
+        
+        old = self.serving
+        self.serving = serving
+        logger.info(f"🔄 向量集合已切换: {old.collection_dir.name} -> {collection_dir.name}")
+        return old
+    
+    def retire_collection(self, old: Optional[ServingIndex]):
+        """延迟删除被替换的集合及其文档块存储，等待进行中的查询结束
+
+        读进程的集合是写进程的发布版本，由写进程清理，这里只关闭文档块存储。
+        """
+        if old is None or old is self.serving:
+            return
+        collection_dir = old.collection_dir
+        
+        def remove():
+            old.chunk_store.close()
+            if self.read_only:
+                return
+            release_chroma_client(collection_dir)
+            self._remove_collection_files(collection_dir, old.chunk_store.store_dir)
+            logger.info(f"🗑️ 已删除旧向量集合: {collection_dir.name}")
+        
+        if self.retire_delay <= 0:
+            remove()
+            return
+        timer = threading.Timer(self.retire_delay, remove)
+        timer.daemon = True
+        self._retire_timers = [t for t in self._retire_timers if not t.finished.is_set()] + [timer]
+        timer.start()
+    
+    @staticmethod
+    def _remove_collection_files(collection_dir: Path, store_dir: Optional[Path]):
+        """删除集合目录及其文档块存储"""
+        shutil.rmtree(collection_dir, ignore_errors=True)
+        if store_dir is None or not store_dir.exists():
+            return
+        if store_dir == settings.CHUNK_STORE_DIR:
+            # 默认集合的文档块存储位于根目录，其他版本的目录也在其中
+            for path in store_dir.iterdir():
+                if path.is_file():
+                    path.unlink(missing_ok=True)
+        else:
+            shutil.rmtree(store_dir, ignore_errors=True)
+    
+    def flush_retired(self):
+        """进程退出前立即删除仍在等待的旧集合（守护线程的定时器不会在退出后执行）"""
+        timers, self._retire_timers = self._retire_timers, []
+        for timer in timers:
+            if not timer.finished.is_set():
+                timer.cancel()
+                timer.function()
+    
+    def claim_vector_db(self):
+        """独占向量库目录，并清理 CURRENT 不再指向的集合
+
+        服务（单进程或写进程）启动时和命令行的恢复/压缩前调用；另一个进程
+        已占用时抛出 VectorDBBusyError，避免两个进程各自切换集合。
+        """
+        if self._owner_lock is None and fcntl is not None:
+            settings.VECTOR_DB_DIR.mkdir(parents=True, exist_ok=True)
+            lock_file = open(settings.VECTOR_DB_DIR / OWNER_LOCK, "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                raise VectorDBBusyError(
+                    f"向量库 {settings.VECTOR_DB_DIR} 正被另一个进程使用，"
+                    "请通过服务的管理接口操作或先停止服务"
+                )
+            self._owner_lock = lock_file
+        self.sweep_collections()
+    
+    def sweep_collections(self):
+        """删除上次退出前未来得及删除、或中途失败的恢复/压缩留下的集合（需占用向量库）"""
+        current = self.current_collection_dir()
+        versioned_prefix = f"{DEFAULT_COLLECTION_DIR}-"
+        stale = [
+            path for path in settings.VECTOR_DB_DIR.iterdir()
+            if path.is_dir() and path != current
+            and (path.name == DEFAULT_COLLECTION_DIR or path.name.startswith(versioned_prefix))
+        ]
+        for path in stale:
+            self._remove_collection_files(path, self.chunk_store_dir(path))
+        
+        # 只剩文档块存储的版本（集合目录已删除）
+        current_store = self.chunk_store_dir(current)
+        orphans = []
+        if settings.CHUNK_STORE_DIR.exists():
+            orphans = [
+                path for path in settings.CHUNK_STORE_DIR.iterdir()
+                if path.is_dir() and path.name.startswith(versioned_prefix) and path != current_store
+            ]
+        for path in orphans:
+            shutil.rmtree(path, ignore_errors=True)
+        
+        if stale or orphans:
+            logger.info(f"🧹 已清理 {len(stale)} 个不再使用的向量集合和 {len(orphans)} 个文档块存储")
+    
+    def index_version(self) -> Optional[str]:
+        """当前所服务知识库状态的版本，读进程为所加载发布版本记录的写进程版本"""
+        return self.serving.version() if self.serving else None
+    
+    def ensure_writable(self):
+        """读进程拒绝写操作"""
+        if self.read_only:
+            raise ReadOnlyIndexError("当前为只读工作进程，请将写操作发送到写进程")
+    
+    def add_change_listener(self, listener: Callable[[], None]):
+        """注册知识库变更回调（写进程用于发布新索引版本）"""
+        self._change_listeners.append(listener)
+    
+    def notify_index_changed(self):
+        """通知知识库已变更"""
+        for listener in self._change_listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.error(f"❌ 知识库变更回调失败: {e}")
+    
     def is_initialized(self) -> bool:
         """检查是否已初始化"""
         return self.initialized
     
-    def add_documents(self, documents: List[str], metadata: List[Dict] = None):
-        """添加文档到知识库"""
+    def add_documents(
+        self,
+        documents: List[Union[str, List[Segment]]],
+        metadata: List[Dict] = None
+    ):
+        """添加文档到知识库
+
+        documents 可以是纯文本，也可以是提取器输出的结构化片段列表。
+        文档元数据只登记一次到文档表，每个块在向量库中仅保存 chunk_id / doc_id。
+        """
+        self.ensure_writable()
         if not self.initialized:
             self.initialize()
         
+        with self.write_lock:
+            success = self._add_documents(documents, metadata)
+        
+        if success:
+            self.notify_index_changed()
+        return success
+    
+    def _add_documents(
+        self,
+        documents: List[Union[str, List[Segment]]],
+        metadata: List[Dict] = None
+    ) -> bool:
+        """分割并写入文档（需持有写锁）
+
+        块ID在写入向量库之前分配；向量写入失败时回滚本次登记的文档和块，
+        避免文档块存储中留下没有向量的记录。
+        """
+        chunk_store = self.chunk_store
+        first_chunk_id = len(chunk_store)
+        doc_ids: List[int] = []
+        texts, metadatas, ids = [], [], []
         try:
-            # 文本分割
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=settings.CHUNK_SIZE,
-                chunk_overlap=settings.CHUNK_OVERLAP,
-                separators=["\n\n", "\n", "。", "！", "？", "；", "，", "、", " "]
-            )
-            
-            chunks = text_splitter.create_documents(documents, metadata)
+            for i, document in enumerate(documents):
+                doc_metadata = metadata[i] if metadata and i < len(metadata) else {}
+                
+                # 文本分割
+                if isinstance(document, str):
+                    _, chunks = self.text_splitter.split_text(document)
+                else:
+                    _, chunks = self.text_splitter.split_segments(document)
+                
+                doc_id = chunk_store.add_document(doc_metadata)
+                doc_ids.append(doc_id)
+                
+                # 每个不同的标题路径登记为一个章节
+                heading_paths = list(dict.fromkeys(tuple(chunk.heading_path) for chunk in chunks))
+                section_ids = dict(zip(heading_paths, chunk_store.add_sections(doc_id, heading_paths)))
+                
+                spans = [
+                    (chunk.start, chunk.end, chunk.page, section_ids[tuple(chunk.heading_path)])
+                    for chunk in chunks
+                ]
+                for chunk, chunk_id in zip(chunks, chunk_store.append_chunks(doc_id, spans)):
+                    texts.append(chunk.text)
+                    metadatas.append({"chunk_id": chunk_id, "doc_id": doc_id})
+                    ids.append(str(chunk_id))
             
             # 添加到向量存储
-            self.vector_store.add_documents(chunks)
-            self.vector_store.persist()
+            if texts:
+                self.vector_store.add_texts(texts, metadatas=metadatas, ids=ids)
+                self.vector_store.persist()
             
-            logger.info(f"✅ 已添加 {len(chunks)} 个文档块到知识库")
+            logger.info(f"✅ 已添加 {len(texts)} 个文档块到知识库")
             return True
             
         except Exception as e:
             logger.error(f"❌ 添加文档失败: {e}")
+            self._rollback_documents(first_chunk_id, doc_ids, ids)
             return False
     
+    def _rollback_documents(self, first_chunk_id: int, doc_ids: List[int], ids: List[str]):
+        """撤销一次失败的入库（需持有写锁）"""
+        try:
+            if ids:
+                # 向量库可能已写入部分批次
+                self.vector_store.delete(ids=ids)
+            self.chunk_store.rollback(first_chunk_id, doc_ids)
+        except Exception as e:
+            logger.error(f"❌ 回滚入库失败: {e}")
+    
+    @staticmethod
+    def _resolve_metadata(metadata: Dict, chunk_store: ChunkStore) -> Dict:
+        """用检索所用集合的文档块存储解析块引用，兼容旧格式的完整元数据"""
+        chunk_id = metadata.get("chunk_id")
+        if chunk_id is None:
+            return metadata
+        return chunk_store.resolve(int(chunk_id)) or metadata
+    
+    def _coalescing_key(self, kind: str, question: str) -> tuple:
+        """相同归一化问题和检索范围的请求共用同一个key"""
+        return (
+            kind,
+            normalize_question(question),
+            str(self.collection_dir),
+            settings.SIMILARITY_TOP_K,
+        )
+    
     def ask_question(self, question: str) -> Dict[str, Any]:
         """提问问题"""
         if not self.initialized:
             self.initialize()
         
+        query_precomputer.log_query(question)
+        
+        if not settings.REQUEST_COALESCING_ENABLED:
+            return self._answer_question(question)
+        
+        result, coalesced = request_coalescer.do(
+            self._coalescing_key("ask", question),
+            lambda: self._answer_question(question)
+        )
+        return {**result, "question": question, "coalesced": coalesced}
+    
+    def stream_question(self, question: str) -> Iterator[str]:
+        """流式提问，相同的并发问题共享同一个token流"""
+        if not self.initialized:
+            self.initialize()
+        
+        query_precomputer.log_query(question)
+        
+        if not settings.REQUEST_COALESCING_ENABLED:
+            return self._generate_stream(question)
+        
+        return request_coalescer.stream(
+            self._coalescing_key("stream", question),
+            lambda: self._generate_stream(question)
+        )
+    
+    def _generate_stream(self, question: str) -> Iterator[str]:
+        """检索上下文并逐token生成回答"""
+        index = self.serving
+        enhanced_question = self._enhance_question(question)
+        precomputed = query_precomputer.lookup(question, index.version())
+        if precomputed is not None:
+            contents = [result["content"] for result in precomputed]
+        else:
+            docs = index.vector_store.similarity_search(
+                enhanced_question, k=settings.SIMILARITY_TOP_K
+            )
+            contents = [doc.page_content for doc in docs]
+        prompt = self._build_prompt(enhanced_question, contents)
+        
+        answer = ""
+        for token in self.llm.stream(prompt):
+            answer += token
+            yield token
+        
+        self.memory.save_context(
+            {"input": question},
+            {"output": answer}
+        )
+    
+    def _build_prompt(self, enhanced_question: str, contents: List[str]) -> str:
+        """用检索到的文档块拼出问答提示词"""
+        return self.prompt_template.format(
+            context="\n\n".join(contents),
+            question=enhanced_question,
+            keywords=", ".join(self.ev_keywords)
+        )
+    
+    def _answer_question(self, question: str) -> Dict[str, Any]:
+        """执行检索问答"""
         try:
+            # 检索、生成和来源解析都使用同一个集合及其文档块存储
+            index = self.serving
+            
             # 增强问题（添加电动汽车领域上下文）
             enhanced_question = self._enhance_question(question)
             
+            # 高频问题直接使用预计算的检索结果，跳过嵌入和向量检索
+            precomputed = query_precomputer.lookup(question, index.version())
+            if precomputed is not None:
+                return self._answer_with_results(question, enhanced_question, precomputed, index.chunk_store)
+            
             # 执行问答
-            result = self.qa_chain({
+            result = index.qa_chain({
                 "query": enhanced_question,
                 "keywords": ", ".join(self.ev_keywords)
             })
@@ -152,7 +603,7 @@ class EVRAGService:
                 for doc in result["source_documents"]:
                     source_info = {
                         "content": doc.page_content[:200] + "...",
-                        "metadata": doc.metadata
+                        "metadata": self._resolve_metadata(doc.metadata, index.chunk_store)
                     }
                     sources.append(source_info)
             
@@ -167,9 +618,13 @@ class EVRAGService:
                 "sources": sources,
                 "question": question,
                 "enhanced_question": enhanced_question,
-                "domain": "electric_vehicles"
+                "domain": "electric_vehicles",
+                "precomputed": False
             }
             
+        except (SchedulerOverloaded, SchedulerTimeout):
+            # 交给API层返回429/503
+            raise
         except Exception as e:
             logger.error(f"❌ 问答失败: {e}")
             return {
@@ -179,6 +634,38 @@ class EVRAGService:
                 "error": str(e)
             }
     
+    def _answer_with_results(
+        self,
+        question: str,
+        enhanced_question: str,
+        results: List[Dict[str, Any]],
+        chunk_store: ChunkStore
+    ) -> Dict[str, Any]:
+        """基于预计算的检索结果生成回答"""
+        answer = self.llm.invoke(self._build_prompt(enhanced_question, [result["content"] for result in results]))
+        
+        sources = [
+            {
+                "content": result["content"][:200] + "...",
+                "metadata": self._resolve_metadata(result["metadata"], chunk_store)
+            }
+            for result in results
+        ]
+        
+        self.memory.save_context(
+            {"input": question},
+            {"output": answer}
+        )
+        
+        return {
+            "answer": answer,
+            "sources": sources,
+            "question": question,
+            "enhanced_question": enhanced_question,
+            "domain": "electric_vehicles",
+            "precomputed": True
+        }
+    
     def _enhance_question(self, question: str) -> str:
         """增强问题 - 添加电动汽车领域上下文"""
         enhanced = question
@@ -198,13 +685,14 @@ class EVRAGService:
             self.initialize()
         
         try:
-            results = self.vector_store.similarity_search_with_score(query, k=k)
+            index = self.serving
+            results = index.vector_store.similarity_search_with_score(query, k=k)
             
             formatted_results = []
             for doc, score in results:
                 formatted_results.append({
                     "content": doc.page_content,
-                    "metadata": doc.metadata,
+                    "metadata": self._resolve_metadata(doc.metadata, index.chunk_store),
                     "score": float(score)
                 })
             
@@ -221,11 +709,16 @@ class EVRAGService:
         
         try:
             # 获取集合信息
-            collection = self.vector_store._collection
-            count = collection.count() if collection else 0
+            index = self.serving
+            if isinstance(index.vector_store, PublishedVectorStore):
+                count = index.vector_store.count()
+            else:
+                collection = index.vector_store._collection
+                count = collection.count() if collection else 0
             
             return {
                 "document_count": count,
+                "source_documents": index.chunk_store.document_count(),
                 "domain": settings.DOMAIN,
                 "keywords": self.ev_keywords,
                 "model": settings.OLLAMA_MODEL,
@@ -243,15 +736,20 @@ class EVRAGService:
             }
     
     def clear_knowledge_base(self) -> bool:
-        """清空知识库"""
-        try:
-            if self.vector_store:
-                self.vector_store.delete_collection()
-                self.vector_store = None
-            
-            # 重新初始化
-            self.initialized = False
+        """清空知识库
+
+        切换到一个新的空集合，而不是先删除再重建，查询始终有可用的集合。
+        """
+        self.ensure_writable()
+        if not self.initialized:
             self.initialize()
+        
+        try:
+            with self.write_lock:
+                # 新集合对应一个新的空文档块存储
+                old = self.swap_vector_store(self.new_collection_dir())
+            self.retire_collection(old)
+            self.notify_index_changed()
             
             logger.info("✅ 知识库已清空")
             return True
@@ -0,0 +1,134 @@
+"""
+电动汽车知识问答系统 - 并发请求合并 (single-flight)
+"""
+import re
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+from loguru import logger
+
+# 问题归一化时忽略的结尾标点
+_TRAILING_PUNCTUATION = "?？!！。.,，;；~～ "
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题文本，用于判断两个请求是否相同"""
+    normalized = _WHITESPACE_RE.sub(" ", question).strip().casefold()
+    return normalized.rstrip(_TRAILING_PUNCTUATION)
+
+
+class _Flight:
+    """一次进行中的计算"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class _StreamFlight:
+    """一次进行中的流式计算，所有订阅者共享同一个token缓冲区"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.tokens: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+
+
+class RequestCoalescer:
+    """合并相同的并发请求：同一时刻相同key只执行一次计算"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._streams: Dict[Hashable, _StreamFlight] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """执行或加入计算，返回 (结果, 是否复用了其他请求的结果)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+            if flight.waiters:
+                logger.debug(f"🔗 合并了 {flight.waiters} 个相同请求")
+
+        return flight.result, False
+
+    def stream(self, key: Hashable, fn: Callable[[], Iterator[str]]) -> Iterator[str]:
+        """订阅流式计算，相同key的并发请求共享同一个token流"""
+        with self._lock:
+            flight = self._streams.get(key)
+            if flight is None:
+                flight = _StreamFlight()
+                self._streams[key] = flight
+                # 由后台线程驱动生成，避免首个订阅者断开后其他订阅者被阻塞
+                threading.Thread(
+                    target=self._pump, args=(key, flight, fn), daemon=True
+                ).start()
+            flight.subscribers += 1
+
+        return self._subscribe(flight)
+
+    def _pump(self, key: Hashable, flight: _StreamFlight, fn: Callable[[], Iterator[str]]):
+        """把生成的token写入共享缓冲区"""
+        try:
+            for token in fn():
+                with flight.condition:
+                    flight.tokens.append(token)
+                    flight.condition.notify_all()
+        except BaseException as e:
+            logger.error(f"❌ 流式生成失败: {e}")
+            flight.error = e
+        finally:
+            with self._lock:
+                self._streams.pop(key, None)
+            with flight.condition:
+                flight.finished = True
+                flight.condition.notify_all()
+            if flight.subscribers > 1:
+                logger.debug(f"🔗 {flight.subscribers} 个请求共享了同一个token流")
+
+    @staticmethod
+    def _subscribe(flight: _StreamFlight) -> Iterator[str]:
+        """从头读取共享缓冲区，直到生成结束"""
+        position = 0
+        while True:
+            with flight.condition:
+                while position >= len(flight.tokens) and not flight.finished:
+                    flight.condition.wait()
+                pending = flight.tokens[position:]
+                finished = flight.finished
+            for token in pending:
+                yield token
+            position += len(pending)
+            if finished and position >= len(flight.tokens):
+                break
+
+        if flight.error is not None:
+            raise flight.error
+
+# 全局请求合并实例
+request_coalescer = RequestCoalescer()
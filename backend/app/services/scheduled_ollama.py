@@ -0,0 +1,112 @@
+"""
+电动汽车知识问答系统 - 经过调度器的Ollama客户端
+"""
+from typing import Any, Iterator, List, Optional
+
+import requests
+
+from langchain_core.callbacks.manager import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from langchain_community.embeddings import OllamaEmbeddings
+from langchain_community.llms import Ollama
+
+from app.core.config import settings
+from app.services.llm_scheduler import llm_scheduler, LLMPriority
+
+
+class _TimeoutOllamaEmbeddings(OllamaEmbeddings):
+    """OllamaEmbeddings 的请求没有超时参数，节点无响应时会一直占用槽位"""
+
+    timeout: Optional[float] = None
+
+    def _process_emb_response(self, input: str) -> List[float]:
+        try:
+            res = requests.post(
+                f"{self.base_url}/api/embeddings",
+                headers={"Content-Type": "application/json"},
+                json={"model": self.model, "prompt": input, **self._default_params},
+                timeout=self.timeout,
+            )
+        except requests.exceptions.RequestException as e:
+            raise ValueError(f"Error raised by inference endpoint: {e}")
+
+        if res.status_code != 200:
+            raise ValueError(
+                f"Error raised by inference API HTTP code: {res.status_code}, {res.text}"
+            )
+        return res.json()["embedding"]
+
+
+class ScheduledOllama(LLM):
+    """每次生成前向调度器申请槽位，并发送到分配的Ollama节点"""
+
+    model: str
+    temperature: Optional[float] = None
+    num_predict: Optional[int] = None
+    priority: LLMPriority = LLMPriority.INTERACTIVE
+
+    @property
+    def _llm_type(self) -> str:
+        return "scheduled-ollama"
+
+    def _client(self, base_url: str) -> Ollama:
+        return Ollama(
+            base_url=base_url,
+            model=self.model,
+            temperature=self.temperature,
+            num_predict=self.num_predict,
+            timeout=settings.LLM_REQUEST_TIMEOUT
+        )
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        with llm_scheduler.acquire(self.model, self.priority) as base_url:
+            return self._client(base_url).invoke(prompt, stop=stop, **kwargs)
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        # 流式生成期间一直占用槽位
+        with llm_scheduler.acquire(self.model, self.priority) as base_url:
+            for token in self._client(base_url).stream(prompt, stop=stop, **kwargs):
+                chunk = GenerationChunk(text=token)
+                if run_manager:
+                    run_manager.on_llm_new_token(token, chunk=chunk)
+                yield chunk
+
+
+class ScheduledOllamaEmbeddings(Embeddings):
+    """经过调度器的嵌入模型：查询走交互队列，文档入库走批处理队列"""
+
+    def __init__(self, model: str, batch_size: int = None):
+        self.model = model
+        self.batch_size = batch_size or settings.LLM_EMBED_BATCH_SIZE
+
+    def _client(self, base_url: str) -> OllamaEmbeddings:
+        return _TimeoutOllamaEmbeddings(
+            base_url=base_url, model=self.model, timeout=settings.LLM_REQUEST_TIMEOUT
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """分批嵌入，每批单独排队，让交互请求可以插队"""
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            with llm_scheduler.acquire(self.model, LLMPriority.BATCH) as base_url:
+                embeddings.extend(self._client(base_url).embed_documents(batch))
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        with llm_scheduler.acquire(self.model, LLMPriority.INTERACTIVE) as base_url:
+            return self._client(base_url).embed_query(text)
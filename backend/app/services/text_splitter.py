@@ -0,0 +1,158 @@
+"""
+电动汽车知识问答系统 - 结构感知文本分割
+"""
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, List, NamedTuple, Optional, Tuple
+
+SEGMENT_SEPARATOR = "\n\n"
+
+# 中英文句子边界：中文句末标点（含后随引号/括号）、后跟空白的英文句点、换行
+_SENTENCE_RE = re.compile(
+    r"[^。！？；!?;\n]*?(?:[。！？；!?;]+[”’\"』」）)]*|\.(?=\s|$)|\n+|$)"
+)
+_BLANK_LINE_RE = re.compile(r"\n\s*\n")
+
+
+@dataclass
+class Segment:
+    """提取器输出的结构化片段"""
+    text: str
+    kind: str = "paragraph"  # heading | paragraph | table
+    level: int = 0  # 标题级别，仅对heading有效
+    page: Optional[int] = None
+
+
+@dataclass
+class TextChunk:
+    """分割结果，偏移量指向拼接后的文档全文"""
+    text: str
+    start: int
+    end: int
+    page: Optional[int] = None
+    heading_path: List[str] = field(default_factory=list)
+
+
+class _Unit(NamedTuple):
+    """不可再分的最小单元（句子、表格行或标题）"""
+    start: int
+    end: int
+    page: Optional[int]
+
+
+def segments_from_text(text: str, page: Optional[int] = None) -> List[Segment]:
+    """把无结构文本按空行切分为段落片段"""
+    return [
+        Segment(text=block.strip(), page=page)
+        for block in _BLANK_LINE_RE.split(text)
+        if block.strip()
+    ]
+
+
+def join_segments(segments: List[Segment]) -> str:
+    """拼接片段为文档全文"""
+    return SEGMENT_SEPARATOR.join(segment.text for segment in segments)
+
+
+class StructuredTextSplitter:
+    """单次线性扫描的分割器：按章节切分，块不跨越标题，并记录每块的标题路径"""
+
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap 必须小于 chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def split_text(self, text: str) -> Tuple[str, List[TextChunk]]:
+        """分割无结构文本"""
+        return self.split_segments(segments_from_text(text))
+
+    def split_segments(self, segments: List[Segment]) -> Tuple[str, List[TextChunk]]:
+        """分割结构化片段，返回 (文档全文, 文档块列表)"""
+        full_text = join_segments(segments)
+        chunks: List[TextChunk] = []
+        headings: List[Tuple[int, str]] = []
+        units: Deque[_Unit] = deque()
+        pending = False  # 当前窗口中是否有尚未输出的内容
+
+        def emit():
+            chunks.append(TextChunk(
+                text=full_text[units[0].start:units[-1].end],
+                start=units[0].start,
+                end=units[-1].end,
+                page=units[0].page,
+                heading_path=[title for _, title in headings],
+            ))
+
+        def add(unit: _Unit, content: bool = True):
+            nonlocal pending
+            if units and unit.end - units[0].start > self.chunk_size:
+                if pending:
+                    emit()
+                # 保留末尾不超过 chunk_overlap 的单元作为重叠
+                while units and (
+                    units[-1].end - units[0].start > self.chunk_overlap
+                    or unit.end - units[0].start > self.chunk_size
+                ):
+                    units.popleft()
+            units.append(unit)
+            pending = pending or content
+
+        def flush():
+            nonlocal pending
+            if pending:
+                emit()
+            units.clear()
+            pending = False
+
+        offset = 0
+        for segment in segments:
+            start = offset
+            offset += len(segment.text) + len(SEGMENT_SEPARATOR)
+
+            if segment.kind == "heading":
+                # 新章节：结束当前块并更新标题路径
+                flush()
+                level = max(segment.level, 1)
+                while headings and headings[-1][0] >= level:
+                    headings.pop()
+                headings.append((level, segment.text.strip()))
+                # 标题作为章节首块的开头，但不单独成块
+                add(_Unit(start, start + len(segment.text), segment.page), content=False)
+                continue
+
+            for unit_start, unit_end in self._iter_units(segment, start):
+                add(_Unit(unit_start, unit_end, segment.page))
+
+        flush()
+        return full_text, chunks
+
+    def _iter_units(self, segment: Segment, base: int):
+        """把片段拆成单元，超过 chunk_size 的单元再按长度硬切"""
+        if segment.kind == "table" and len(segment.text) <= self.chunk_size:
+            # 较小的表格整体保留
+            spans = [(0, len(segment.text))]
+        elif segment.kind == "table":
+            spans = self._iter_lines(segment.text)
+        else:
+            spans = (match.span() for match in _SENTENCE_RE.finditer(segment.text))
+
+        for start, end in spans:
+            # 去掉首尾空白，保证块边界落在内容上
+            while start < end and segment.text[start].isspace():
+                start += 1
+            while end > start and segment.text[end - 1].isspace():
+                end -= 1
+            if start == end:
+                continue
+            for piece_start in range(start, end, self.chunk_size):
+                yield base + piece_start, base + min(piece_start + self.chunk_size, end)
+
+    @staticmethod
+    def _iter_lines(text: str):
+        """按行切分表格"""
+        start = 0
+        for line in text.split("\n"):
+            yield start, start + len(line)
+            start += len(line) + 1
@@ -0,0 +1,314 @@
+"""
+电动汽车知识问答系统 - 向量库快照、恢复与压缩
+"""
+import gzip
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Sequence
+from loguru import logger
+
+import chromadb
+import numpy as np
+
+from app.core.config import settings
+from app.services.published_index import SegmentWriter
+from app.services.rag_service import rag_service, COLLECTION_NAME
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_SUFFIX = ".evsnap"
+
+
+class EVVectorStoreManager:
+    """向量库运维：导出快照、从快照恢复、在线压缩
+
+    快照是一个tar包：manifest.json、vectors.npy（float32矩阵）、
+    records.jsonl.gz（id/文本/元数据）以及文档块存储的副本。
+    恢复和压缩都写入新的集合目录和对应的文档块存储目录，完成后一起切换；
+    进行中的查询使用开始时取得的集合和块表，不会用新的块表解析旧集合中的块ID。
+    """
+
+    def __init__(self):
+        self.batch_size = settings.SNAPSHOT_BATCH_SIZE
+
+    def snapshot_path(self, name: str) -> Path:
+        """快照名称对应的文件路径（只允许位于快照目录下）"""
+        name = Path(name).name
+        if not name.endswith(SNAPSHOT_SUFFIX):
+            name += SNAPSHOT_SUFFIX
+        return settings.SNAPSHOT_DIR / name
+
+    def list_snapshots(self) -> list:
+        """列出快照目录中的快照"""
+        return [
+            {"name": path.name, "size": path.stat().st_size, "modified": path.stat().st_mtime}
+            for path in sorted(settings.SNAPSHOT_DIR.glob(f"*{SNAPSHOT_SUFFIX}"))
+        ]
+
+    def _iter_batches(
+        self,
+        collection,
+        include: Sequence[str] = ("embeddings", "documents", "metadatas")
+    ) -> Iterator[Dict[str, Any]]:
+        """分批读取集合中的全部记录"""
+        offset = 0
+        while True:
+            batch = collection.get(
+                limit=self.batch_size,
+                offset=offset,
+                include=list(include)
+            )
+            if not batch["ids"]:
+                break
+            yield batch
+            offset += len(batch["ids"])
+
+    def _create_collection(self, collection_dir: Path, metadata: Optional[Dict] = None):
+        """在新目录中创建空集合，保持原集合的距离度量等配置"""
+        client = chromadb.PersistentClient(path=str(collection_dir))
+        return client.get_or_create_collection(COLLECTION_NAME, metadata=metadata or None)
+
+    def export_segment(self, collection, segment_dir: Path, end: int, start: Optional[int] = None) -> int:
+        """把块ID在 [start, end) 内的记录导出为发布用的向量段，返回记录数
+
+        集合内块ID只追加，调用方在写锁内取得 end 后即可在锁外读取：之后的写入和回滚
+        只涉及 end 之后的块。start 为 None 时导出整个集合（含没有块ID的旧格式记录）。
+        """
+        writer = SegmentWriter(segment_dir)
+        if start is None:
+            for batch in self._iter_batches(collection):
+                records = [
+                    record for record in zip(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+                    if not record[3] or record[3].get("chunk_id") is None or int(record[3]["chunk_id"]) < end
+                ]
+                if records:
+                    writer.add(*map(list, zip(*records)))
+        else:
+            for offset in range(start, end, self.batch_size):
+                batch = collection.get(
+                    ids=[str(chunk_id) for chunk_id in range(offset, min(offset + self.batch_size, end))],
+                    include=["embeddings", "documents", "metadatas"]
+                )
+                writer.add(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+        return writer.close()
+
+    def export_snapshot(self, snapshot_path: Path) -> Dict[str, Any]:
+        """导出当前知识库为快照文件"""
+        # 读进程没有 chromadb 集合，快照由写进程导出
+        rag_service.ensure_writable()
+        if not rag_service.is_initialized():
+            rag_service.initialize()
+
+        snapshot_path = Path(snapshot_path)
+        started = time.time()
+
+        # 持有写锁以保证向量与文档块存储一致，查询不受影响
+        with rag_service.write_lock, tempfile.TemporaryDirectory(dir=settings.DATA_DIR) as tmp:
+            tmp_dir = Path(tmp)
+            collection = rag_service.vector_store._collection
+            count = collection.count()
+
+            vectors = None
+            written = 0
+            with gzip.open(tmp_dir / "records.jsonl.gz", "wt", encoding="utf-8") as records:
+                for batch in self._iter_batches(collection):
+                    embeddings = np.asarray(batch["embeddings"], dtype=np.float32)
+                    if vectors is None:
+                        vectors = np.lib.format.open_memmap(
+                            tmp_dir / "vectors.npy", mode="w+", dtype=np.float32,
+                            shape=(count, embeddings.shape[1])
+                        )
+                    vectors[written:written + len(embeddings)] = embeddings
+                    written += len(embeddings)
+
+                    for chunk_id, document, metadata in zip(
+                        batch["ids"], batch["documents"], batch["metadatas"]
+                    ):
+                        records.write(json.dumps(
+                            {"id": chunk_id, "document": document, "metadata": metadata},
+                            ensure_ascii=False
+                        ) + "\n")
+
+            dimension = 0
+            if vectors is None:
+                np.save(tmp_dir / "vectors.npy", np.empty((0, 0), dtype=np.float32))
+            else:
+                dimension = vectors.shape[1]
+                vectors.flush()
+                del vectors
+
+            rag_service.chunk_store.export_to(tmp_dir / "chunk_store")
+
+            manifest = {
+                "format": SNAPSHOT_FORMAT,
+                "created_at": time.time(),
+                "count": written,
+                "dimension": dimension,
+                "collection_name": COLLECTION_NAME,
+                "collection_metadata": collection.metadata,
+                "embedding_model": settings.OLLAMA_EMBEDDING_MODEL,
+            }
+            (tmp_dir / "manifest.json").write_text(
+                json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8"
+            )
+
+            # 先写临时文件再原子替换，避免留下不完整的快照
+            snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_snapshot = snapshot_path.with_name(snapshot_path.name + ".tmp")
+            with tarfile.open(tmp_snapshot, "w") as tar:
+                for path in sorted(tmp_dir.rglob("*")):
+                    tar.add(path, arcname=str(path.relative_to(tmp_dir)), recursive=False)
+            os.replace(tmp_snapshot, snapshot_path)
+
+        logger.info(f"📦 快照已导出: {snapshot_path} ({written} 个文档块, {time.time() - started:.1f}秒)")
+        return {**manifest, "path": str(snapshot_path), "size": snapshot_path.stat().st_size}
+
+    @staticmethod
+    def _safe_extract(tar: tarfile.TarFile, target_dir: Path):
+        """解压快照，拒绝指向目标目录之外的成员"""
+        target = target_dir.resolve()
+        for member in tar.getmembers():
+            member_path = (target / member.name).resolve()
+            if not (member.isfile() or member.isdir()) or target not in (member_path, *member_path.parents):
+                raise ValueError(f"快照包含非法成员: {member.name}")
+        tar.extractall(target)
+
+    def restore_snapshot(self, snapshot_path: Path) -> Dict[str, Any]:
+        """从快照恢复知识库，直接导入向量，无需重新嵌入"""
+        rag_service.ensure_writable()
+        if not rag_service.is_initialized():
+            rag_service.initialize()
+
+        snapshot_path = Path(snapshot_path)
+        started = time.time()
+
+        with tempfile.TemporaryDirectory(dir=settings.DATA_DIR) as tmp:
+            tmp_dir = Path(tmp)
+            with tarfile.open(snapshot_path, "r") as tar:
+                self._safe_extract(tar, tmp_dir)
+
+            manifest = json.loads((tmp_dir / "manifest.json").read_text(encoding="utf-8"))
+            if manifest.get("format") != SNAPSHOT_FORMAT:
+                raise ValueError(f"不支持的快照格式: {manifest.get('format')}")
+            if manifest.get("embedding_model") != settings.OLLAMA_EMBEDDING_MODEL:
+                raise ValueError(
+                    f"快照的嵌入模型 ({manifest.get('embedding_model')}) "
+                    f"与当前配置 ({settings.OLLAMA_EMBEDDING_MODEL}) 不一致"
+                )
+
+            vectors = np.load(tmp_dir / "vectors.npy", mmap_mode="r")
+
+            with rag_service.write_lock:
+                collection_dir = rag_service.new_collection_dir()
+                collection = self._create_collection(collection_dir, manifest.get("collection_metadata"))
+
+                offset = 0
+                with gzip.open(tmp_dir / "records.jsonl.gz", "rt", encoding="utf-8") as records:
+                    while True:
+                        batch = [json.loads(line) for line in islice(records, self.batch_size)]
+                        if not batch:
+                            break
+                        collection.add(
+                            ids=[record["id"] for record in batch],
+                            embeddings=vectors[offset:offset + len(batch)].tolist(),
+                            documents=[record["document"] for record in batch],
+                            metadatas=[record["metadata"] for record in batch]
+                        )
+                        offset += len(batch)
+
+                shutil.copytree(tmp_dir / "chunk_store", rag_service.chunk_store_dir(collection_dir))
+                old = rag_service.swap_vector_store(collection_dir)
+
+            del vectors
+
+        rag_service.retire_collection(old)
+        rag_service.notify_index_changed()
+        logger.info(f"📥 快照已恢复: {snapshot_path} ({offset} 个文档块, {time.time() - started:.1f}秒)")
+        return {**manifest, "restored": offset, "collection": collection_dir.name}
+
+    @staticmethod
+    def _dir_size(path: Path) -> int:
+        return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+    def compact(self) -> Dict[str, Any]:
+        """在线压缩：把仍然存在的块复制到新集合后切换，回收已删除块占用的空间
+
+        文档块存储同时压缩：只保留向量库中仍被引用的块并重新编号，
+        不再有块的文档和章节一并删除。
+        """
+        rag_service.ensure_writable()
+        if not rag_service.is_initialized():
+            rag_service.initialize()
+
+        started = time.time()
+        with rag_service.write_lock:
+            source_dir = rag_service.collection_dir
+            source_store_dir = rag_service.chunk_store.store_dir
+            source = rag_service.vector_store._collection
+            size_before = self._dir_size(source_dir) + self._store_size(source_store_dir)
+
+            # 第一遍只读元数据，确定仍被引用的块
+            referenced = [
+                int(metadata["chunk_id"])
+                for batch in self._iter_batches(source, include=("metadatas",))
+                for metadata in batch["metadatas"]
+                if metadata and metadata.get("chunk_id") is not None
+            ]
+
+            collection_dir = rag_service.new_collection_dir()
+            store_dir = rag_service.chunk_store_dir(collection_dir)
+            id_map = rag_service.chunk_store.compact_to(store_dir, referenced)
+            collection = self._create_collection(collection_dir, source.metadata)
+
+            copied = dropped = 0
+            for batch in self._iter_batches(source):
+                ids, embeddings, documents, metadatas = [], [], [], []
+                for record in zip(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"]):
+                    record_id, embedding, document, metadata = record
+                    if metadata and metadata.get("chunk_id") is not None:
+                        new_id = id_map.get(int(metadata["chunk_id"]))
+                        if new_id is None:
+                            # 块表中已没有对应的行，无法解析来源
+                            dropped += 1
+                            continue
+                        record_id = str(new_id)
+                        metadata = {**metadata, "chunk_id": new_id}
+                    ids.append(record_id)
+                    embeddings.append(embedding)
+                    documents.append(document)
+                    metadatas.append(metadata)
+                if ids:
+                    collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+                copied += len(ids)
+
+            old = rag_service.swap_vector_store(collection_dir)
+
+        rag_service.retire_collection(old)
+        rag_service.notify_index_changed()
+        size_after = self._dir_size(collection_dir) + self._store_size(store_dir)
+        logger.info(
+            f"🧹 向量库压缩完成: {copied} 个文档块（丢弃 {dropped} 个无效块）, "
+            f"{size_before} -> {size_after} 字节 ({time.time() - started:.1f}秒)"
+        )
+        return {
+            "chunks": copied,
+            "dropped": dropped,
+            "size_before": size_before,
+            "size_after": size_after,
+            "collection": collection_dir.name,
+        }
+
+    @staticmethod
+    def _store_size(store_dir: Path) -> int:
+        """文档块存储的大小（默认集合的存储位于根目录，不计入其他版本的子目录）"""
+        if not store_dir.exists():
+            return 0
+        return sum(path.stat().st_size for path in store_dir.iterdir() if path.is_file())
+
+# 全局向量库运维实例
+vector_store_manager = EVVectorStoreManager()
@@ -2,13 +2,22 @@
 Local Smart Doc - 后端主入口
 """
 import os
+import subprocess
+import sys
+from pathlib import Path
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 from loguru import logger
 
 from app.core.config import settings
 from app.api.v1.api import api_router
+from app.services.llm_scheduler import SchedulerOverloaded, SchedulerTimeout, start_scheduler_server
+from app.services.index_publisher import index_publisher
+from app.services.pdf_backends import pdf_extractor
+from app.services.rag_service import rag_service, ReadOnlyIndexError
 
 # 生命周期管理
 @asynccontextmanager
@@ -26,9 +35,24 @@ async def lifespan(app: FastAPI):
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
     os.makedirs(settings.VECTOR_DB_DIR, exist_ok=True)
     
+    # 单进程和写进程独占向量库目录，并清理上次退出时未删除的旧集合
+    if settings.INDEX_ROLE != "reader":
+        await run_in_threadpool(rag_service.claim_vector_db)
+    
+    # 多进程模式：写进程发布索引，读进程加载已发布的索引
+    if settings.INDEX_ROLE == "writer":
+        logger.info(f"✍️ Index writer (pid {os.getpid()})")
+        await run_in_threadpool(index_publisher.start_writer)
+    elif settings.INDEX_ROLE == "reader":
+        logger.info(f"📖 Index reader (pid {os.getpid()})")
+        await run_in_threadpool(index_publisher.start_reader)
+    
     yield
     
     # 关闭时
+    await run_in_threadpool(index_publisher.stop)
+    await run_in_threadpool(rag_service.flush_retired)
+    await run_in_threadpool(pdf_extractor.close)
     logger.info("👋 Shutting down Local Smart Doc Backend")
 
 # 创建FastAPI应用
@@ -50,6 +74,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# LLM调度器的快速拒绝
+@app.exception_handler(SchedulerOverloaded)
+async def scheduler_overloaded_handler(request, exc: SchedulerOverloaded):
+    """队列已满时返回429及排队位置"""
+    return JSONResponse(
+        status_code=429,
+        content={
+            "detail": str(exc),
+            "queue_position": exc.queue_position,
+            "retry_after": round(exc.retry_after, 1),
+        },
+        headers={"Retry-After": str(int(exc.retry_after + 0.5))},
+    )
+
+@app.exception_handler(SchedulerTimeout)
+async def scheduler_timeout_handler(request, exc: SchedulerTimeout):
+    """排队超时返回503"""
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(ReadOnlyIndexError)
+async def read_only_index_handler(request, exc: ReadOnlyIndexError):
+    """读进程收到写请求时返回409，并指明写进程端口"""
+    return JSONResponse(
+        status_code=409,
+        content={"detail": str(exc), "writer_port": settings.WRITER_PORT},
+    )
+
 # 包含API路由
 app.include_router(api_router, prefix="/api/v1")
 
@@ -72,12 +123,51 @@ async def health_check():
     """
     return {"status": "healthy", "service": "local-smart-doc"}
 
-if __name__ == "__main__":
+def run_multi_worker():
+    """
+    多进程模式：一个写进程负责入库并发布索引，WORKERS个读进程处理查询，
+    另有一个调度进程统一分配所有进程的Ollama请求槽位
+    """
     import uvicorn
-    uvicorn.run(
-        "main:app",
-        host=settings.HOST,
-        port=settings.PORT,
-        reload=settings.DEBUG,
-        log_level="info"
+    
+    # 所有进程的Ollama请求由同一个调度进程分配槽位，并发上限对整个部署生效
+    scheduler_server = start_scheduler_server()
+    
+    writer = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", settings.HOST,
+            "--port", str(settings.WRITER_PORT),
+            "--log-level", "info",
+        ],
+        cwd=Path(__file__).parent,
+        env={**os.environ, "INDEX_ROLE": "writer"},
     )
+    
+    # 读进程继承环境变量
+    os.environ["INDEX_ROLE"] = "reader"
+    try:
+        uvicorn.run(
+            "main:app",
+            host=settings.HOST,
+            port=settings.PORT,
+            workers=settings.WORKERS,
+            log_level="info"
+        )
+    finally:
+        writer.terminate()
+        writer.wait()
+        scheduler_server.shutdown()
+
+if __name__ == "__main__":
+    import uvicorn
+    if settings.WORKERS > 1:
+        run_multi_worker()
+    else:
+        uvicorn.run(
+            "main:app",
+            host=settings.HOST,
+            port=settings.PORT,
+            reload=settings.DEBUG,
+            log_level="info"
+        )
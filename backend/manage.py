@@ -0,0 +1,59 @@
+"""
+Local Smart Doc - 管理命令
+
+    python manage.py snapshot <文件>   导出向量库快照
+    python manage.py restore <文件>    从快照恢复向量库（无需重新嵌入）
+    python manage.py compact           压缩向量库，回收已删除块的空间
+
+restore 和 compact 需要先停止服务（服务运行时请使用 /api/v1/admin 下的接口）。
+    python manage.py precompute        挖掘查询日志，预计算高频问题的嵌入和检索结果
+    python manage.py precompute --refresh  只用已保存的嵌入重新检索
+"""
+import argparse
+import json
+from pathlib import Path
+
+from app.services.query_precompute import query_precomputer
+from app.services.rag_service import rag_service
+from app.services.vector_store_manager import vector_store_manager
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Smart Doc 管理命令")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    snapshot_parser = subparsers.add_parser("snapshot", help="导出向量库快照")
+    snapshot_parser.add_argument("path", type=Path)
+    
+    restore_parser = subparsers.add_parser("restore", help="从快照恢复向量库")
+    restore_parser.add_argument("path", type=Path)
+    
+    subparsers.add_parser("compact", help="压缩向量库")
+    
+    precompute_parser = subparsers.add_parser("precompute", help="预计算高频问题的检索结果")
+    precompute_parser.add_argument("--refresh", action="store_true", help="只重新检索，不重新挖掘查询日志")
+    
+    args = parser.parse_args()
+    
+    if args.command in ("restore", "compact"):
+        # 服务运行时会继续写入旧集合，拒绝在命令行中切换
+        rag_service.claim_vector_db()
+        # 没有进行中的查询，被替换的集合立即删除
+        rag_service.retire_delay = 0
+    
+    if args.command == "snapshot":
+        result = vector_store_manager.export_snapshot(args.path)
+    elif args.command == "restore":
+        result = vector_store_manager.restore_snapshot(args.path)
+    elif args.command == "compact":
+        result = vector_store_manager.compact()
+    elif args.refresh:
+        if not rag_service.is_initialized():
+            rag_service.initialize()
+        result = query_precomputer.refresh(rag_service)
+    else:
+        result = query_precomputer.build(rag_service)
+    
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
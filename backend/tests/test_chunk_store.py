@@ -0,0 +1,81 @@
+"""
+文档块存储测试：登记与解析、失败入库回滚、压缩重新编号
+"""
+import pytest
+
+from app.services.chunk_store import ChunkStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ChunkStore(tmp_path / "store")
+    yield store
+    store.close()
+
+
+def add_document(store: ChunkStore, filename: str, spans):
+    """登记一个单章节文档，spans 为 (start, end, page)"""
+    doc_id = store.add_document({"filename": filename, "extension": ".pdf", "size": 10, "author": "EV"})
+    section_ids = store.add_sections(doc_id, [["第1章", filename]])
+    chunk_ids = store.append_chunks(doc_id, [(start, end, page, section_ids[0]) for start, end, page in spans])
+    return doc_id, chunk_ids
+
+
+def test_resolve_chunk_metadata(store):
+    doc_id, chunk_ids = add_document(store, "battery.pdf", [(0, 10, 0), (8, 20, None)])
+    assert chunk_ids == [0, 1]
+    assert len(store) == 2
+
+    metadata = store.resolve(1)
+    assert metadata["filename"] == "battery.pdf"
+    assert metadata["author"] == "EV"
+    assert metadata["doc_id"] == doc_id
+    assert (metadata["start"], metadata["end"], metadata["page"]) == (8, 20, None)
+    assert metadata["heading_path"] == ["第1章", "battery.pdf"]
+    assert store.resolve(2) is None
+
+
+def test_rollback_removes_failed_import(store):
+    add_document(store, "kept.pdf", [(0, 10, 0)])
+    first_chunk_id = len(store)
+    failed_doc, _ = add_document(store, "failed.pdf", [(0, 5, 0), (5, 9, 1)])
+
+    store.rollback(first_chunk_id, [failed_doc])
+
+    assert len(store) == 1
+    assert store.get_chunk(1) is None
+    assert store.get_document(failed_doc) is None
+    assert store.document_count() == 1
+    assert store.resolve(0)["filename"] == "kept.pdf"
+    # 回滚后新块从原位置继续编号
+    _, chunk_ids = add_document(store, "retry.pdf", [(0, 7, 2)])
+    assert chunk_ids == [1]
+    assert store.resolve(1)["filename"] == "retry.pdf"
+
+
+def test_compact_to_renumbers_kept_chunks(store, tmp_path):
+    add_document(store, "a.pdf", [(0, 10, 0), (10, 20, 1)])
+    dropped_doc, _ = add_document(store, "b.pdf", [(0, 5, 0)])
+    add_document(store, "c.pdf", [(0, 8, 3)])
+
+    # 块2所在文档不再被引用，超出范围的ID被忽略
+    mapping = store.compact_to(tmp_path / "compacted", [3, 1, 0, 99])
+    assert mapping == {0: 0, 1: 1, 3: 2}
+
+    compacted = ChunkStore(tmp_path / "compacted", read_only=True)
+    try:
+        assert len(compacted) == 3
+        assert compacted.document_count() == 2
+        assert compacted.get_document(dropped_doc) is None
+        for old_id, new_id in mapping.items():
+            old, new = store.resolve(old_id), compacted.resolve(new_id)
+            assert new["chunk_id"] == new_id
+            old.pop("chunk_id")
+            new.pop("chunk_id")
+            assert new == old
+    finally:
+        compacted.close()
+
+    # 源存储保持不变
+    assert len(store) == 4
+    assert store.resolve(2)["filename"] == "b.pdf"
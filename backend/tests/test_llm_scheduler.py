@@ -0,0 +1,150 @@
+"""
+LLM调度器测试：按模型限流、最少负载路由、交互保留槽位和队列满时拒绝
+"""
+import pickle
+import subprocess
+import sys
+import threading
+import time
+from contextlib import ExitStack
+
+import pytest
+
+from app.services.llm_scheduler import (
+    LLMPriority,
+    LLMScheduler,
+    SchedulerOverloaded,
+    SchedulerTimeout,
+)
+
+ENDPOINT_A = "http://ollama-a:11434"
+ENDPOINT_B = "http://ollama-b:11434"
+
+
+def make_scheduler(**overrides) -> LLMScheduler:
+    options = dict(
+        endpoints=[ENDPOINT_A, ENDPOINT_B],
+        endpoint_concurrency=2,
+        model_concurrency={},
+        default_model_concurrency=8,
+        max_queue={LLMPriority.INTERACTIVE: 8, LLMPriority.BATCH: 8},
+    )
+    options.update(overrides)
+    return LLMScheduler(**options)
+
+
+def wait_until(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待条件超时"
+        time.sleep(0.01)
+
+
+def test_routes_to_least_loaded_endpoint():
+    scheduler = make_scheduler()
+    with ExitStack() as stack:
+        endpoints = [stack.enter_context(scheduler.acquire("llama")) for _ in range(4)]
+        assert endpoints == [ENDPOINT_A, ENDPOINT_B, ENDPOINT_A, ENDPOINT_B]
+        assert scheduler.get_stats()["endpoints"] == {ENDPOINT_A: 2, ENDPOINT_B: 2}
+    assert scheduler.get_stats()["endpoints"] == {ENDPOINT_A: 0, ENDPOINT_B: 0}
+
+
+def test_model_concurrency_cap():
+    scheduler = make_scheduler(model_concurrency={"big": 1})
+    with scheduler.acquire("big"):
+        with pytest.raises(SchedulerTimeout):
+            with scheduler.acquire("big", timeout=0.1):
+                pass
+        # 其他模型不受影响
+        with scheduler.acquire("small", timeout=0.1) as endpoint:
+            assert endpoint == ENDPOINT_B
+    with scheduler.acquire("big", timeout=0.1):
+        pass
+    assert scheduler.get_stats()["timed_out"] == 1
+
+
+def test_batch_cannot_take_reserved_interactive_slots():
+    scheduler = make_scheduler(endpoint_concurrency=1, interactive_reserved_slots=1)
+    with scheduler.acquire("embed", LLMPriority.BATCH):
+        with pytest.raises(SchedulerTimeout):
+            with scheduler.acquire("embed", LLMPriority.BATCH, timeout=0.1):
+                pass
+        with scheduler.acquire("llama", LLMPriority.INTERACTIVE, timeout=0.1) as endpoint:
+            assert endpoint == ENDPOINT_B
+
+
+def test_reserved_slots_leave_one_for_batch():
+    scheduler = make_scheduler(endpoint_concurrency=1, interactive_reserved_slots=5)
+    assert scheduler.interactive_reserved_slots == scheduler.capacity - 1
+    with scheduler.acquire("embed", LLMPriority.BATCH, timeout=0.1):
+        pass
+
+
+def test_interactive_dispatched_before_queued_batch():
+    scheduler = make_scheduler(endpoints=[ENDPOINT_A], endpoint_concurrency=1)
+    order = []
+
+    def request(priority: LLMPriority):
+        with scheduler.acquire("llama", priority):
+            order.append(priority)
+
+    with scheduler.acquire("llama"):
+        batch = threading.Thread(target=request, args=(LLMPriority.BATCH,))
+        batch.start()
+        wait_until(lambda: scheduler.get_stats()["queued"]["batch"] == 1)
+        interactive = threading.Thread(target=request, args=(LLMPriority.INTERACTIVE,))
+        interactive.start()
+        wait_until(lambda: scheduler.get_stats()["queued"]["interactive"] == 1)
+    batch.join()
+    interactive.join()
+    assert order == [LLMPriority.INTERACTIVE, LLMPriority.BATCH]
+
+
+def test_rejects_when_queue_is_full():
+    scheduler = make_scheduler(
+        endpoints=[ENDPOINT_A],
+        endpoint_concurrency=1,
+        max_queue={LLMPriority.INTERACTIVE: 1, LLMPriority.BATCH: 1},
+    )
+
+    def queued_request():
+        with scheduler.acquire("llama"):
+            pass
+
+    with scheduler.acquire("llama"):
+        waiter = threading.Thread(target=queued_request)
+        waiter.start()
+        wait_until(lambda: scheduler.get_stats()["queued"]["interactive"] == 1)
+
+        with pytest.raises(SchedulerOverloaded) as excinfo:
+            with scheduler.acquire("llama"):
+                pass
+        assert excinfo.value.priority == LLMPriority.INTERACTIVE
+        assert excinfo.value.queue_position == 2
+        assert excinfo.value.retry_after >= 1.0
+    waiter.join()
+    assert scheduler.get_stats()["rejected"] == 1
+    assert scheduler.get_stats()["completed"] == 2
+
+
+def test_overloaded_survives_pickling():
+    # 多进程部署时异常由调度进程传回工作进程
+    error = pickle.loads(pickle.dumps(SchedulerOverloaded(LLMPriority.BATCH, 3, 4.0)))
+    assert (error.priority, error.queue_position, error.retry_after) == (LLMPriority.BATCH, 3, 4.0)
+    assert "batch" in str(error)
+
+
+def test_releases_slots_of_exited_owner():
+    scheduler = make_scheduler(endpoints=[ENDPOINT_A], endpoint_concurrency=1)
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+
+    scheduler.acquire_slot("llama", owner=process.pid)
+    with pytest.raises(SchedulerTimeout):
+        scheduler.acquire_slot("llama", timeout=0.1)
+
+    assert scheduler.release_dead_owners() == 1
+    seq, endpoint = scheduler.acquire_slot("llama", timeout=0.1)
+    assert endpoint == ENDPOINT_A
+    scheduler.release_slot(seq)
+    assert scheduler.get_stats()["endpoints"] == {ENDPOINT_A: 0}
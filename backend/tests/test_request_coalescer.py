@@ -0,0 +1,118 @@
+"""
+请求合并测试：相同key的并发请求共享一次计算和同一个token流
+"""
+import threading
+import time
+
+import pytest
+
+from app.services.request_coalescer import RequestCoalescer, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("  电池  寿命多久？ ") == normalize_question("电池 寿命多久")
+    assert normalize_question("What is BMS?!") == "what is bms"
+    assert normalize_question("电池寿命") != normalize_question("电机寿命")
+
+
+def run_concurrently(count: int, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(index: int):
+        try:
+            results[index] = target()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_do_shares_one_computation():
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    threads, results, errors = run_concurrently(3, lambda: coalescer.do("q", compute))
+    # 等待跟随者加入后再放行
+    while "q" not in coalescer._flights or coalescer._flights["q"].waiters < 2:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert errors == [None] * 3
+    assert sorted(coalesced for _, coalesced in results) == [False, True, True]
+    assert {result for result, _ in results} == {"answer"}
+    # 计算结束后相同key重新执行
+    assert coalescer.do("q", lambda: "again") == ("again", False)
+
+
+def test_do_propagates_error_to_waiters():
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+
+    def compute():
+        release.wait(5)
+        raise ValueError("ollama down")
+
+    threads, _, errors = run_concurrently(2, lambda: coalescer.do("q", compute))
+    while "q" not in coalescer._flights or coalescer._flights["q"].waiters < 1:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert [type(error) for error in errors] == [ValueError, ValueError]
+    assert not coalescer._flights
+
+
+def test_stream_subscribers_share_tokens():
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        yield "电池"
+        release.wait(5)
+        yield "寿命"
+        yield "八年"
+
+    first = coalescer.stream("q", generate)
+    assert next(first) == "电池"
+    # 中途加入的订阅者从头读取共享缓冲区
+    second = coalescer.stream("q", generate)
+    release.set()
+
+    assert list(first) == ["寿命", "八年"]
+    assert list(second) == ["电池", "寿命", "八年"]
+    assert calls == [1]
+
+
+def test_stream_error_reaches_every_subscriber():
+    coalescer = RequestCoalescer()
+    release = threading.Event()
+
+    def generate():
+        yield "部分"
+        release.wait(5)
+        raise RuntimeError("stream broken")
+
+    first = coalescer.stream("q", generate)
+    second = coalescer.stream("q", generate)
+    release.set()
+
+    for subscriber in (first, second):
+        assert next(subscriber) == "部分"
+        with pytest.raises(RuntimeError, match="stream broken"):
+            list(subscriber)
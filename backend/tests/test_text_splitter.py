@@ -0,0 +1,86 @@
+"""
+结构感知文本分割测试：偏移量、标题路径、页码和重叠
+"""
+import pytest
+
+from app.services.text_splitter import Segment, StructuredTextSplitter
+
+SECTIONS = [
+    Segment("电池管理", kind="heading", level=1, page=0),
+    Segment("电池管理系统负责监控电芯电压。它还负责均衡。温度过高时会限制功率！", page=0),
+    Segment("热管理", kind="heading", level=2, page=1),
+    Segment("液冷系统通过冷却液带走热量。风冷成本更低。", page=1),
+    Segment("电机", kind="heading", level=1, page=2),
+    Segment("| 型号 | 功率 |\n| A | 150kW |", kind="table", page=2),
+]
+
+LONG_TEXT = (
+    "Battery packs age with every charge cycle. Fast charging adds heat. "
+    "Heat accelerates degradation.\n\n"
+    "电动汽车的续航受温度影响很大。冬季续航通常下降百分之二十到三十。预热电池可以缓解。\n\n"
+    "A single very long sentence without any punctuation that must be cut by length"
+)
+
+
+def assert_offsets(full_text, chunks, chunk_size):
+    assert chunks
+    for chunk in chunks:
+        assert full_text[chunk.start:chunk.end] == chunk.text
+        assert len(chunk.text) <= chunk_size
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(20, 0), (40, 10), (64, 16), (500, 50)])
+def test_offsets_point_into_full_text(chunk_size, chunk_overlap):
+    splitter = StructuredTextSplitter(chunk_size, chunk_overlap)
+    for full_text, chunks in (splitter.split_text(LONG_TEXT), splitter.split_segments(SECTIONS)):
+        assert_offsets(full_text, chunks, chunk_size)
+
+
+def test_heading_paths_and_pages():
+    full_text, chunks = StructuredTextSplitter(40, 10).split_segments(SECTIONS)
+    assert [chunk.heading_path for chunk in chunks] == [
+        ["电池管理"],
+        ["电池管理", "热管理"],
+        ["电机"],
+    ]
+    assert [chunk.page for chunk in chunks] == [0, 1, 2]
+    # 标题作为章节首块的开头
+    assert all(chunk.text.startswith(chunk.heading_path[-1]) for chunk in chunks)
+    # 较小的表格整体保留
+    assert chunks[-1].text.endswith("| A | 150kW |")
+
+
+def test_chunks_do_not_cross_headings():
+    _, chunks = StructuredTextSplitter(12, 4).split_segments(SECTIONS)
+    for chunk in chunks:
+        for title in ("电池管理", "热管理", "电机"):
+            if title in chunk.text:
+                assert chunk.text.startswith(title)
+                assert chunk.heading_path[-1] == title
+
+
+def test_overlap_stays_within_limit():
+    chunk_overlap = 30
+    _, chunks = StructuredTextSplitter(80, chunk_overlap).split_text(LONG_TEXT)
+    overlaps = [
+        previous.end - current.start
+        for previous, current in zip(chunks, chunks[1:])
+        if current.start < previous.end
+    ]
+    assert overlaps
+    assert all(0 < overlap <= chunk_overlap for overlap in overlaps)
+
+
+def test_large_table_split_by_rows():
+    rows = [f"| 型号{index} | {100 + index}kW |" for index in range(10)]
+    table = Segment("\n".join(rows), kind="table", page=3)
+    full_text, chunks = StructuredTextSplitter(40, 0).split_segments([table])
+    assert_offsets(full_text, chunks, 40)
+    for chunk in chunks:
+        assert all(line in rows for line in chunk.text.split("\n"))
+    assert "\n".join(chunk.text for chunk in chunks) == table.text
+
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        StructuredTextSplitter(100, 100)